@@ -1,87 +1,299 @@
 import json
 import sys
 from emailmanager import EmailManager
+from notifier import NotificationAggregator
 from pathlib import Path
-from selenium import webdriver
+import random
+import signal
+import threading
 import time
-from sitemanager import SiteManager
+from concurrent.futures import Future, ThreadPoolExecutor
+from sitemanager import SiteManager, SiteConfigError
+from sitegroup import SiteGroup
+from sitewatcher import SiteWatcher
+from drivermanager import DriverPool
+from browseroptions import BrowserOptions
+from httpfetcher import HTTPFetcher
+from scheduler import Scheduler
+from metrics import Metrics
+from diagnostics import DiagnosticsWriter
+from circuitbreaker import CircuitBreaker, RetryPolicy
+from statestore import StateStore
+from urllib.parse import urlparse
+from typing import Callable
 
 # Load json config
+def load_config() -> dict:
+    '''Loads and validates config information from config.json.'''
+    try:
+        with open('config.json') as config_file:
+            try:
+                config = json.load(config_file)
+                if not config.get('smtpServer'): # if the smtpServer doesn't exist, exit with an error message
+                    print('ERROR: config.json must contain smtpServer options. See documentation for details.')
+                    sys.exit()
+                if not config.get('sendFrom'): # if the sendFrom object doesn't exist, exit with an error message
+                    print('ERROR: config.json must contain sendFrom options. See documentation for details.')
+                    sys.exit()
+            except json.decoder.JSONDecodeError as error: # if there is an error while decoding the json, exit with an error message
+                print("ERROR: config.json is not a valid json file. See message below for decoder response.")
+                print("Message:", error)
+                sys.exit()
+    except FileNotFoundError: # if config.json doesn't exit, exit with an error message
+        print("ERROR: Must have a config.json file in the application directory.")
+        sys.exit()
+    return config
 
 class App:
 
-    def __init__(self):
-        self.site_managers: list[SiteManager] = []
+    def __init__(self, site_filter: Callable[[Path], bool] | None = None, email_manager: EmailManager | None = None):
+        '''Sets up the app. A site filter can be given to only load some of the site configs, and an email manager can be given to replace the one built from config.json.'''
+        self.site_filter = site_filter
+        self.site_groups: list[SiteGroup] = []
+        self.site_groups_by_page: dict[tuple[str, str], SiteGroup] = {} # (url, engine) -> the group that loads that page
+        self.site_managers: dict[str, SiteManager] = {} # site key -> the site manager loaded from that file
+        self.lock = threading.Lock() # guards the site groups and round_checks, which are updated from worker threads
+        self.round_checks = 0
+        self.stopping = threading.Event()
         self.load_config_file()
-        self.load_diagnostic_folder()
 
         self.wait_time: (int | float) = self.config.get('waitTime') if self.config.get('waitTime') else 0
+        self.reload_interval: (int | float) = self.config.get('reloadInterval', 2) # seconds between checks of the sites directory, 0 turns reloading off
+        if type(self.reload_interval) not in (int, float) or self.reload_interval < 0:
+            print("ERROR: 'reloadInterval' must be a number of seconds that is not negative. Please check config.json.")
+            sys.exit()
+        metrics_config: dict = self.config.get('metrics', {})
+        self.metrics: Metrics = Metrics(Path(metrics_config.get('directory', 'metrics')), metrics_config.get('interval', 60))
+        diagnostics_config: dict = self.config.get('diagnostics', {})
+        self.diagnostics_writer: DiagnosticsWriter = DiagnosticsWriter(self.diagnostics_folder(), self.metrics, diagnostics_config.get('maxSizeMB', 0), diagnostics_config.get('maxAgeDays', 0))
+        self.max_browsers: int = self.config.get('maxBrowsers') if self.config.get('maxBrowsers') else 1
+        self.browser_options: BrowserOptions = BrowserOptions(self.config.get('browser', {}))
+        self.driver_pool: DriverPool = DriverPool(self.max_browsers, self.browser_options, self.metrics, self.config.get('maxPagesPerDriver', 0), self.config.get('maxDriverMemory', 0))
+        self.http_connections: int = self.config.get('httpConnections') if self.config.get('httpConnections') else 10
+        self.http_fetcher: HTTPFetcher = HTTPFetcher(self.http_connections)
+        self.auto_http_slots = threading.BoundedSemaphore(max(1, self.http_connections // 2)) # HTTP threads that can run auto pages, which might wait there for a browser
+        self.scheduler: Scheduler = Scheduler(self.wait_time)
+        self.retry_policy: RetryPolicy = RetryPolicy(self.config.get('retry', {}))
+        self.host_breakers: dict[str, CircuitBreaker] = {}
+        self.state_store: StateStore = StateStore(Path(self.config.get('stateFile', 'state.db')))
+        self.saved_state: dict[str, dict] = self.state_store.load()
 
-
-        self.email_manager: EmailManager = EmailManager(self.config['smtpServer'], self.config['sendFrom'])
+        if email_manager is None:
+            email_manager = NotificationAggregator(EmailManager(self.config['smtpServer'], self.config['sendFrom'], self.metrics), self.config.get('notifications', {}))
+        self.email_manager: EmailManager | NotificationAggregator = email_manager
         self.load_sites()
 
+    def diagnostics_folder(self) -> Path:
+        '''The folder diagnostic data is saved to.'''
+        return Path('.') / 'diagnostics'
+
     def load_config_file(self):
         '''Loads and validates config information from config.json.'''
-        try:
-            with open('config.json') as config_file:
-                try:
-                    self.config = json.load(config_file)
-                    if not self.config.get('smtpServer'): # if the smtpServer doesn't exist, exit with an error message
-                        print('ERROR: config.json must contain smtpServer options. See documentation for details.')
-                        sys.exit()
-                    if not self.config.get('sendFrom'): # if the sendFrom object doesn't exist, exit with an error message
-                        print('ERROR: config.json must contain sendFrom options. See documentation for details.')
-                        sys.exit()
-                except json.decoder.JSONDecodeError as error: # if there is an error while decoding the json, exit with an error message
-                    print("ERROR: config.json is not a valid json file. See message below for decoder response.")
-                    print("Message:", error)
-                    sys.exit()
-        except FileNotFoundError: # if config.json doesn't exit, exit with an error message
-            print("ERROR: Must have a config.json file in the application directory.")
-            sys.exit()
+        self.config = load_config()
     
     def load_sites(self):
-        '''Loads selenium managers from the sites config files.'''
-        self.driver = None
-
+        '''Loads site managers from the sites config files, and groups together the ones that watch the same page.'''
         # start loading sites
         sites_dir = Path('.') / 'sites'
         if not sites_dir.exists(): # if the sites directory doesn't exist, exit with an error message
             print("ERROR: 'sites' directory is required. See documentation for more details.")
             sys.exit()
-        sites = sites_dir.glob('*.json')
-        for site in sites:
-            if site.name[0] != '.': # skip files with a .name
-                self.site_managers.append(SiteManager(self.driver, site, self.email_manager))
+        self.site_watcher = SiteWatcher(sites_dir, self.site_filter)
+        added, _, _ = self.site_watcher.poll()
+        for site in added:
+            site_manager = self.load_site(site)
+            if site_manager is None:
+                continue
+            if self.saved_state.get(site_manager.key, {}).get('fingerprint') == site_manager.fingerprint: # carry on from where the last run stopped, unless the file now tests something else
+                site_manager.restore_state(self.saved_state[site_manager.key])
+            self.add_site(site_manager)
+        print(f'Loaded {len(self.site_managers)} sites on {len(self.site_groups)} pages.')
+
+    def load_site(self, site: Path) -> SiteManager | None:
+        '''Creates the site manager for a site config file. Returns None if the file is invalid, so one bad file doesn't stop every other site.'''
+        try:
+            return SiteManager(None, site, self.email_manager, self.http_fetcher, self.metrics, self.diagnostics_writer, self.retry_policy)
+        except SiteConfigError as error:
+            print(f'{error} The file will be skipped.')
+        except OSError as error: # deleted or unreadable since it was seen
+            print(f"ERROR: site configuration '{site.name}' could not be read. The file will be skipped. Error message: {error}")
+        return None
+
+    def add_site(self, site_manager: SiteManager) -> SiteGroup | None:
+        '''Adds a site manager to the group for its page. Returns the group if a new one had to be created, so it can be scheduled, otherwise returns None.'''
+        page = (site_manager.url, site_manager.engine)
+        with self.lock:
+            self.site_managers[site_manager.key] = site_manager
+            if page in self.site_groups_by_page:
+                self.site_groups_by_page[page].add(site_manager)
+                return None
+            site_group = SiteGroup(site_manager.url, site_manager.engine, self.get_host_breaker(site_manager.url))
+            site_group.add(site_manager)
+            self.site_groups_by_page[page] = site_group
+            self.site_groups.append(site_group)
+            return site_group
+
+    def retire_site(self, key: str) -> SiteManager | None:
+        '''Disables the site manager loaded from a config file, if there is one, and returns it. Its group drops it before the next check.'''
+        with self.lock:
+            site_manager = self.site_managers.pop(key, None)
+        if site_manager is not None:
+            site_manager.stop()
+        return site_manager
+
+    def reload_sites(self):
+        '''Applies changes to the sites directory while the app is running. Only files that were added, changed or removed are read, and every other site carries on untouched.'''
+        added, changed, removed = self.site_watcher.poll()
+        for site in removed:
+            site_manager = self.retire_site(site.name)
+            if site_manager is not None:
+                print(f"[SITES] '{site.name}' was removed. Site '{site_manager.name}' has been retired.")
+        for site in added + changed:
+            try:
+                self.reload_site(site)
+            except Exception as error: # one bad file must never stop the app
+                print(f"[ERROR] Unexpected error while loading site configuration '{site.name}'. The file will be skipped. Error message: {error}")
+
+    def reload_site(self, site: Path):
+        '''Loads a site config that was added or changed, replacing the site manager loaded from its old version.'''
+        site_manager = self.load_site(site)
+        if site_manager is None: # if an existing file was broken by the change, its old version keeps running
+            return
+        old_site_manager = self.retire_site(site.name)
+        if old_site_manager is not None and old_site_manager.same_test_as(site_manager): # e.g. only the recipients changed, so don't send another email for the same stock
+            site_manager.restore_state(old_site_manager.get_state(None))
+        new_site_group = self.add_site(site_manager)
+        if new_site_group is not None:
+            self.scheduler.schedule(new_site_group, random.uniform(0, new_site_group.jitter))
+        print(f"[SITES] {'Reloaded' if old_site_manager is not None else 'Loaded new'} site '{site_manager.name}' from '{site.name}'.")
+
+    def get_host_breaker(self, url: str) -> CircuitBreaker:
+        '''Returns the circuit breaker for the url's host, creating it the first time the host is seen.'''
+        host = urlparse(url).hostname or url
+        if host not in self.host_breakers:
+            self.host_breakers[host] = CircuitBreaker(self.retry_policy)
+        return self.host_breakers[host]
+
+    def first_check_delay(self, site_group: SiteGroup) -> float:
+        '''Returns how long to wait before a group's first check. Groups pick up the schedule saved by the last run, and new groups are spread out by their jitter.'''
+        saved_due = [self.saved_state[site_manager.key]['next_due'] for site_manager in site_group.site_managers if self.saved_state.get(site_manager.key, {}).get('next_due') is not None]
+        if saved_due:
+            return max(0.0, min(saved_due) - time.time())
+        return random.uniform(0, site_group.jitter)
 
     def run(self):
         '''Starts running the app. This includes starting up webdrivers and actively performing testing.'''
-        while len(self.site_managers) > 0:
-            driver = webdriver.Firefox()
-            driver.implicitly_wait(10)
-            tmp_site_managers = self.site_managers.copy()
-            for site_manager in tmp_site_managers:
-                site_manager.driver = driver
-                site_enabled = site_manager.run()
-                if not site_enabled:
-                    self.site_managers.remove(site_manager)
-            driver.quit()
-            if self.wait_time > 0:
-                print(f'Waiting {self.wait_time} seconds according to config...')
-                time.sleep(self.wait_time)
-        print('No sites are still running! The program will now exit.')
-        self.stop()
-    
-    def load_diagnostic_folder(self):
-        diagnostics_folder = Path('.') / 'diagnostics'
-        if not diagnostics_folder.exists():
-            diagnostics_folder.mkdir()
+        self.metrics.start()
+        if threading.current_thread() is threading.main_thread(): # signal handlers can only be set from the main thread
+            for signal_number in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signal_number, lambda signal_number, frame: self.request_stop()) # finish the running checks and clean up instead of dying mid-check
+        for site_group in self.site_groups:
+            self.scheduler.schedule(site_group, self.first_check_delay(site_group))
+
+        round_count = 0
+        round_start = time.perf_counter()
+        next_reload = time.monotonic() + self.reload_interval
+        startup_before = self.driver_pool.total_startup_time
+        try:
+            # browser pages get their own threads, one per browser, so pages waiting for a browser never hold up HTTP pages
+            with ThreadPoolExecutor(max_workers=self.max_browsers) as browser_executor, ThreadPoolExecutor(max_workers=self.http_connections) as http_executor:
+                while (len(self.site_groups) > 0 or self.reload_interval) and not self.stopping.is_set(): # while reloading, new sites can still be added, so an empty sites folder keeps waiting
+                    site_group = self.scheduler.next_due(timeout=1)
+                    if site_group is not None and not site_group.host_breaker.allow_request(): # the host is failing, so wait for its next probe
+                        self.scheduler.schedule(site_group, site_group.host_breaker.time_until_retry())
+                    elif site_group is not None:
+                        # auto pages only borrow a browser if they fall back to one. Pages that fell back last time go to the browser threads, and
+                        # only some HTTP threads can run auto pages, so pages waiting for a browser can never hold up every HTTP page
+                        auto_on_http = site_group.engine == 'auto' and not site_group.fell_back and self.auto_http_slots.acquire(blocking=False)
+                        executor = http_executor if site_group.engine == 'http' or auto_on_http else browser_executor
+                        future = executor.submit(self.check_site_group, site_group)
+                        if auto_on_http:
+                            future.add_done_callback(lambda future: self.auto_http_slots.release())
+                        future.add_done_callback(lambda future, site_group=site_group: self.check_finished(site_group, future))
+                    if self.reload_interval and time.monotonic() >= next_reload:
+                        self.reload_sites()
+                        next_reload = time.monotonic() + self.reload_interval
+
+                    # a round is as many checks as there are pages, which is one site loop when every site has the same interval
+                    with self.lock:
+                        round_finished = 0 < len(self.site_groups) <= self.round_checks
+                        if round_finished:
+                            self.round_checks = 0
+                    if round_finished:
+                        round_count += 1
+                        self.log_round_timing(round_count, time.perf_counter() - round_start, self.driver_pool.total_startup_time - startup_before)
+                        round_start = time.perf_counter()
+                        startup_before = self.driver_pool.total_startup_time
+            if not self.stopping.is_set():
+                print('No sites are still running and reloading is off! The program will now exit.')
+        finally: # saves state and sends waiting emails even if the loop fails
+            self.stop()
+
+    def check_site_group(self, site_group: SiteGroup) -> bool:
+        '''Checks every site on the group's page, borrowing a driver from the pool if the page needs a browser. Returns False if every site in the group is disabled.'''
+        with self.metrics.time(site_group.name, 'check'):
+            match site_group.engine:
+                case 'http': # HTTP only sites don't need to wait for a browser
+                    return site_group.run(None)
+                case 'auto': # only takes a browser if the page has to fall back to one
+                    with self.driver_pool.borrow_lazily() as lazy_driver:
+                        group_enabled = site_group.run(lazy_driver.get_driver)
+                        site_group.fell_back = lazy_driver.driver_manager is not None
+                        if site_group.fell_back:
+                            lazy_driver.driver_manager.record_page_load()
+                    return group_enabled
+                case _:
+                    with self.driver_pool.borrow() as driver_manager:
+                        group_enabled = site_group.run(driver_manager.get_driver)
+                        driver_manager.record_page_load()
+                    return group_enabled
+
+    def check_finished(self, site_group: SiteGroup, future: Future):
+        '''Called when a check finishes. Schedules the group's next check, or removes it if all of its sites have been disabled.'''
+        try:
+            group_enabled = future.result()
+        except Exception as error:
+            print(f"[ERROR] Unexpected error while checking sites '{site_group.name}': {error}")
+            group_enabled = True
+        with self.lock:
+            self.round_checks += 1
+            if not group_enabled and len(site_group.site_managers) > 0: # a reload added a site to the group while it was being checked
+                group_enabled = True
+            if not group_enabled:
+                self.site_groups.remove(site_group)
+                del self.site_groups_by_page[(site_group.url, site_group.engine)]
+        if group_enabled:
+            next_due = time.time() + self.scheduler.schedule_next(site_group)
+            for site_manager in site_group.site_managers:
+                self.state_store.update(site_manager.key, site_manager.get_state(next_due))
     
+    def log_round_timing(self, round_count: int, round_time: float, startup_time: float):
+        '''Prints how long a round of checks took, and roughly how much browser startup time was saved by reusing the driver.'''
+        saved_time = self.driver_pool.startup_time_saved(round_count)
+        print(f'[TIMING] Round {round_count} took {round_time:.2f} seconds ({startup_time:.2f} seconds starting Firefox). Reusing the browser has saved about {saved_time:.2f} seconds so far.')
+        slowest_sites = self.metrics.pop_slowest_sites()
+        if slowest_sites:
+            print('[TIMING] Slowest pages this round: ' + ', '.join(f"'{name}' ({duration:.2f} seconds)" for name, duration in slowest_sites))
+
+    def request_stop(self):
+        '''Asks run() to stop dispatching checks. Checks already running are allowed to finish, then the app cleans up and run() returns.'''
+        self.stopping.set()
+
     def stop(self):
-        self.driver.quit()
+        self.driver_pool.stop()
+        self.http_fetcher.close()
+        self.email_manager.stop()
+        self.diagnostics_writer.stop()
+        self.state_store.stop()
+        self.metrics.stop()
 
 if __name__ == "__main__":
-    print('Starting app!')
-    app = App()
-    app.run()
\ No newline at end of file
+    workers = load_config().get('workers', 1)
+    if workers > 1:
+        from coordinator import Coordinator
+        print(f'Starting app with {workers} worker processes!')
+        Coordinator(workers).run()
+    else:
+        print('Starting app!')
+        app = App()
+        app.run()
\ No newline at end of file
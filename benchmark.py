@@ -0,0 +1,299 @@
+# Running this script benchmarks Stock Notifier against a local web server and a local SMTP server, so results don't depend on real sites or email providers.
+# Run `python benchmark.py --help` for the options. Save results with --output and compare later runs against them with --compare.
+
+from app import App
+from email import message_from_bytes
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import argparse
+import base64
+import json
+import os
+import resource
+import socketserver
+import tempfile
+import threading
+import time
+
+try:
+    import psutil
+except ImportError: # without psutil, only the memory of this process is measured, not Firefox's
+    psutil = None
+
+OUT_OF_STOCK = 'Out of Stock'
+
+class ProductPageHandler(BaseHTTPRequestHandler):
+    '''Serves synthetic product pages at /product/<number>. Products below the restock count switch to in stock once the restock time has passed.'''
+
+    server: 'ProductServer'
+
+    def do_GET(self):
+        try:
+            product = int(self.path.rsplit('/', 1)[-1])
+        except ValueError:
+            self.send_error(404)
+            return
+
+        time.sleep(self.server.latency)
+        restocked = product < self.server.restock_count and time.monotonic() >= self.server.restock_time
+        stock_text = 'In Stock' if restocked else OUT_OF_STOCK
+        body = f'<html><body><div id="padding">{self.server.padding}</div><div id="stock">{stock_text}</div></body></html>'.encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # keep the benchmark output readable
+
+class ProductServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, page_size: int, latency: float, restock_count: int, restock_time: float):
+        super().__init__(('127.0.0.1', 0), ProductPageHandler)
+        self.padding = 'x' * page_size
+        self.latency = latency
+        self.restock_count = restock_count
+        self.restock_time = restock_time
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    '''Speaks just enough SMTP to accept emails from EmailManager, and records when each one arrives.'''
+
+    server: 'SMTPSink'
+
+    def reply(self, line: str):
+        self.wfile.write((line + '\r\n').encode())
+
+    def read_line(self) -> str:
+        return self.rfile.readline().decode(errors='replace').rstrip('\r\n')
+
+    def handle(self):
+        self.reply('220 localhost Stock Notifier benchmark sink')
+        while True:
+            line = self.read_line()
+            if not line:
+                return
+            command = line.split(' ', 1)[0].upper()
+            match command:
+                case 'EHLO':
+                    self.reply('250-localhost')
+                    self.reply('250 AUTH PLAIN LOGIN')
+                case 'HELO' | 'MAIL' | 'RCPT' | 'RSET' | 'NOOP':
+                    self.reply('250 OK')
+                case 'AUTH':
+                    self.authenticate(line)
+                case 'DATA':
+                    self.reply('354 End data with <CR><LF>.<CR><LF>')
+                    self.receive_message()
+                    self.reply('250 OK')
+                case 'QUIT':
+                    self.reply('221 Bye')
+                    return
+                case _:
+                    self.reply('502 Command not implemented')
+
+    def authenticate(self, line: str):
+        '''Accepts any login. Only the prompts are needed so that smtplib is happy.'''
+        parts = line.split()
+        if len(parts) == 2 and parts[1].upper() == 'LOGIN':
+            self.reply('334 ' + base64.b64encode(b'Username:').decode())
+            self.read_line()
+            self.reply('334 ' + base64.b64encode(b'Password:').decode())
+            self.read_line()
+        elif len(parts) == 2: # AUTH PLAIN without the initial response
+            self.reply('334 ')
+            self.read_line()
+        self.reply('235 Authentication successful')
+
+    def receive_message(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if line in (b'.\r\n', b'.\n', b''):
+                break
+            lines.append(line[1:] if line.startswith(b'..') else line)
+        message = message_from_bytes(b''.join(lines))
+        self.server.record(time.monotonic(), str(message['Subject']))
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0):
+        super().__init__(('127.0.0.1', port), SMTPSinkHandler)
+        self.lock = threading.Lock()
+        self.messages: list[tuple[float, str]] = []
+
+    def record(self, received_time: float, subject: str):
+        with self.lock:
+            self.messages.append((received_time, subject))
+
+class MemorySampler:
+    '''Samples the memory of this process and every process it started, like geckodriver and Firefox, and keeps the peak.'''
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.peak = 0.0 # MB
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample_loop, name='MemorySampler', daemon=True)
+
+    def sample_loop(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self.sample())
+
+    def sample(self) -> float:
+        if psutil is None:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # ru_maxrss is in KB on Linux
+        process = psutil.Process()
+        total = 0
+        for child in [process] + process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total / (1024 * 1024)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self) -> float:
+        self.stopped.set()
+        self.thread.join()
+        return max(self.peak, self.sample())
+
+class BenchmarkApp(App):
+    '''The real App, with every page check timed.'''
+
+    def __init__(self):
+        self.check_times: list[float] = []
+        self.site_checks = 0
+        super().__init__()
+
+    def check_site_group(self, site_group) -> bool:
+        site_count = len(site_group.site_managers)
+        start_time = time.perf_counter()
+        group_enabled = super().check_site_group(site_group)
+        duration = time.perf_counter() - start_time
+        with self.lock:
+            self.check_times.append(duration)
+            self.site_checks += site_count
+        return group_enabled
+
+def write_configs(directory: Path, args: argparse.Namespace, http_port: int, smtp_port: int):
+    '''Writes config.json and one site config per product into the benchmark directory.'''
+    config = {
+        'smtpServer': {'url': '127.0.0.1', 'login': 'benchmark', 'password': 'benchmark', 'port': smtp_port, 'tls': False},
+        'sendFrom': {'displayName': 'Stock Notifier Benchmark', 'emailAddress': 'benchmark@localhost'},
+        'waitTime': args.interval,
+        'maxBrowsers': args.max_browsers,
+        'httpConnections': args.http_connections,
+        'metrics': {'interval': 0},
+        'browser': {'headless': True, 'pageLoadStrategy': 'eager'},
+    }
+    (directory / 'config.json').write_text(json.dumps(config, indent=4))
+
+    sites_dir = directory / 'sites'
+    sites_dir.mkdir()
+    for product in range(args.sites):
+        site = {
+            'name': f'Product {product}',
+            'url': f'http://127.0.0.1:{http_port}/product/{product}',
+            'elementXPath': '//div[@id="stock"]',
+            'testType': 'element_does_not_contain_text',
+            'compareValue': OUT_OF_STOCK,
+            'sendTo': [{'emailAddress': f'recipient{product}@localhost', 'displayName': f'Recipient {product}'}],
+            'engine': args.engine,
+        }
+        (sites_dir / f'product{product}.json').write_text(json.dumps(site, indent=4))
+
+def percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))]
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    start_time = time.monotonic()
+    restock_time = start_time + args.restock_after
+    restock_count = int(args.sites * args.restock_fraction)
+
+    product_server = ProductServer(args.page_size * 1024, args.latency / 1000, restock_count, restock_time)
+    smtp_sink = SMTPSink()
+    for server in (product_server, smtp_sink):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    original_directory = Path.cwd()
+    with tempfile.TemporaryDirectory() as directory:
+        write_configs(Path(directory), args, product_server.server_address[1], smtp_sink.server_address[1])
+        os.chdir(directory)
+        try:
+            memory_sampler = MemorySampler()
+            memory_sampler.start()
+            app = BenchmarkApp()
+            threading.Timer(args.duration, app.request_stop).start()
+            run_start = time.perf_counter()
+            app.run() # returns after the duration, once running checks finish and queued emails are sent
+            run_time = time.perf_counter() - run_start
+            peak_memory = memory_sampler.stop()
+        finally:
+            os.chdir(original_directory)
+
+    product_server.shutdown()
+    smtp_sink.shutdown()
+
+    restock_emails = [received_time for received_time, subject in smtp_sink.messages if subject.startswith('Stock Notification')]
+    restock_latencies = [received_time - restock_time for received_time in restock_emails]
+    return {
+        'sites': args.sites,
+        'engine': args.engine,
+        'maxBrowsers': args.max_browsers,
+        'duration': run_time,
+        'pageChecks': len(app.check_times),
+        'siteChecks': app.site_checks,
+        'checksPerSecond': app.site_checks / run_time if run_time else 0.0,
+        'checkLatencyP50': percentile(app.check_times, 50),
+        'checkLatencyP95': percentile(app.check_times, 95),
+        'restocks': restock_count,
+        'restockEmails': len(restock_emails),
+        'restockToEmailP50': percentile(restock_latencies, 50),
+        'restockToEmailMax': max(restock_latencies, default=0.0),
+        'peakMemoryMB': peak_memory,
+    }
+
+def print_results(results: dict, baseline: dict | None):
+    print()
+    print('Benchmark results')
+    for key, value in results.items():
+        line = f'  {key:<20} {value:.3f}' if isinstance(value, float) else f'  {key:<20} {value}'
+        if baseline is not None and isinstance(value, (int, float)) and isinstance(baseline.get(key), (int, float)) and baseline[key]:
+            line += f'   ({(value - baseline[key]) / baseline[key] * 100:+.1f}% vs baseline)'
+        print(line)
+    if results['restockEmails'] < results['restocks']:
+        print(f"WARNING: only {results['restockEmails']} of {results['restocks']} restocks were emailed before the benchmark ended. Try a longer --duration.")
+    if results['restocks'] and results['restockEmails'] == 0:
+        print('WARNING: no restock emails were received, so restockToEmail is not meaningful.')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark Stock Notifier against local stand-in web and SMTP servers.')
+    parser.add_argument('--sites', type=int, default=50, help='number of site configs to generate')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run the app for')
+    parser.add_argument('--engine', choices=('http', 'browser', 'auto'), default='http', help='engine used by every site')
+    parser.add_argument('--max-browsers', type=int, default=1, help='maxBrowsers setting')
+    parser.add_argument('--http-connections', type=int, default=10, help='httpConnections setting')
+    parser.add_argument('--interval', type=float, default=1, help='seconds between checks of each site')
+    parser.add_argument('--page-size', type=int, default=100, help='size of each product page in KB')
+    parser.add_argument('--latency', type=float, default=50, help='milliseconds the web server waits before answering')
+    parser.add_argument('--restock-after', type=float, default=10, help='seconds after the start when products restock')
+    parser.add_argument('--restock-fraction', type=float, default=0.2, help='fraction of products that restock')
+    parser.add_argument('--output', type=Path, help='save the results to this JSON file')
+    parser.add_argument('--compare', type=Path, help='compare the results to a JSON file saved with --output')
+    args = parser.parse_args()
+
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    results = run_benchmark(args)
+    print_results(results, baseline)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=4))
+        print(f'Results saved to {args.output}')
@@ -0,0 +1,69 @@
+from selenium import webdriver
+from selenium.webdriver.firefox.options import Options
+from urllib.parse import quote
+import json
+import sys
+
+BLOCK_PROXY = 'PROXY 127.0.0.1:9' # nothing listens on the discard port, so requests sent here fail straight away
+
+class BrowserOptions:
+    '''Settings from the browser section of config.json, used to make every Firefox session as lean as possible.'''
+
+    def __init__(self, browser_config: dict):
+        self.headless: bool = browser_config.get('headless', False)
+        self.page_load_strategy: str = browser_config.get('pageLoadStrategy', 'normal')
+        self.block_images: bool = browser_config.get('blockImages', False)
+        self.block_media: bool = browser_config.get('blockMedia', False)
+        self.block_fonts: bool = browser_config.get('blockFonts', False)
+        self.blocked_urls: list[str] = browser_config.get('blockedURLs', [])
+        self.page_load_timeout: (int | float) = browser_config.get('pageLoadTimeout', 0)
+        self.validate()
+
+    def validate(self):
+        if self.page_load_strategy not in ('normal', 'eager', 'none'):
+            print("ERROR: browser config is misconfigured. 'pageLoadStrategy' must be one of 'normal', 'eager' or 'none'. Please check config.json.")
+            sys.exit()
+        if type(self.blocked_urls) != list or not all(type(url) == str for url in self.blocked_urls):
+            print("ERROR: browser config is misconfigured. 'blockedURLs' must be a list of domain names. Please check config.json.")
+            sys.exit()
+        if type(self.page_load_timeout) not in (int, float) or self.page_load_timeout < 0:
+            print("ERROR: browser config is misconfigured. 'pageLoadTimeout' must be a number of seconds that is not negative. Please check config.json.")
+            sys.exit()
+
+    def firefox_options(self) -> Options:
+        '''Builds the options that Firefox is started with.'''
+        options = Options()
+        options.page_load_strategy = self.page_load_strategy
+        if self.headless:
+            options.add_argument('-headless')
+        if self.block_images:
+            options.set_preference('permissions.default.image', 2)
+        if self.block_media:
+            options.set_preference('media.autoplay.default', 5) # block all autoplay
+            options.set_preference('media.preload.default', 0) # don't download video or audio until it is played
+            options.set_preference('media.preload.auto', 0)
+        if self.block_fonts:
+            options.set_preference('gfx.downloadable_fonts.enabled', False)
+            options.set_preference('browser.display.use_document_fonts', 0)
+        if self.blocked_urls:
+            # a proxy auto-config script sends requests for blocked domains to a dead proxy, so they fail without touching the network
+            options.set_preference('network.proxy.type', 2)
+            options.set_preference('network.proxy.autoconfig_url', 'data:application/x-ns-proxy-autoconfig,' + quote(self.proxy_auto_config()))
+        return options
+
+    def proxy_auto_config(self) -> str:
+        '''Returns a proxy auto-config script that blocks the blocked URLs and lets everything else through.'''
+        return f'''function FindProxyForURL(url, host) {{
+    var blocked = {json.dumps(self.blocked_urls)};
+    for (var i = 0; i < blocked.length; i++) {{
+        if (host === blocked[i] || dnsDomainIs(host, '.' + blocked[i])) {{
+            return '{BLOCK_PROXY}';
+        }}
+    }}
+    return 'DIRECT';
+}}'''
+
+    def apply(self, driver: webdriver.Firefox):
+        '''Applies the settings that can only be set once Firefox is running.'''
+        if self.page_load_timeout:
+            driver.set_page_load_timeout(self.page_load_timeout)
@@ -0,0 +1,75 @@
+import random
+import sys
+import threading
+import time
+
+class RetryPolicy:
+    '''Settings from the retry section of config.json, shared by every circuit breaker.'''
+
+    def __init__(self, retry_config: dict):
+        self.base_delay: (int | float) = retry_config.get('baseDelay', 5) # seconds before the first retry
+        self.max_delay: (int | float) = retry_config.get('maxDelay', 900) # the delay doubles after each failure, up to this many seconds
+        self.failure_threshold: int = retry_config.get('failureThreshold', 3) # failures in a row before the breaker opens
+        self.error_email_after: (int | float) = retry_config.get('errorEmailAfter', 1800) # seconds the breaker must stay open before an error email is sent
+        for parameter in ('baseDelay', 'maxDelay', 'failureThreshold', 'errorEmailAfter'):
+            if type(retry_config.get(parameter, 0)) not in (int, float) or retry_config.get(parameter, 0) < 0:
+                print(f"ERROR: retry config is misconfigured. '{parameter}' must be a number that is not negative. Please check config.json.")
+                sys.exit()
+
+    def delay(self, failures: int) -> float:
+        '''Returns how long to wait after the given number of failures in a row, with jitter so that failing sites don't all retry at once.'''
+        delay = min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+        return delay * random.uniform(0.5, 1)
+
+class CircuitBreaker:
+    '''Tracks failures for a site or a host. After each failure, the next attempt is pushed back with exponential backoff.
+    Once failures in a row reach the threshold, the breaker opens, and only one probe is let through each time the backoff
+    delay passes. A single success closes the breaker again.'''
+
+    def __init__(self, retry_policy: RetryPolicy):
+        self.retry_policy = retry_policy
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.next_attempt_time = 0.0
+        self.opened_at: float | None = None
+
+    @property
+    def is_failing(self) -> bool:
+        return self.consecutive_failures > 0
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def open_duration(self) -> float:
+        '''How many seconds the breaker has been open for, or 0 if it is closed.'''
+        opened_at = self.opened_at
+        return time.monotonic() - opened_at if opened_at is not None else 0.0
+
+    def time_until_retry(self) -> float:
+        return max(0.0, self.next_attempt_time - time.monotonic())
+
+    def allow_request(self) -> bool:
+        '''Returns whether a check should go ahead. While open, only one probe is allowed each time the backoff delay passes.'''
+        with self.lock:
+            if not self.is_open:
+                return True
+            now = time.monotonic()
+            if now < self.next_attempt_time:
+                return False
+            self.next_attempt_time = now + self.retry_policy.delay(self.consecutive_failures) # hold other checks back while this probe runs
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.next_attempt_time = 0.0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            now = time.monotonic()
+            self.next_attempt_time = now + self.retry_policy.delay(self.consecutive_failures)
+            if self.opened_at is None and self.consecutive_failures >= self.retry_policy.failure_threshold:
+                self.opened_at = now
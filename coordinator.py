@@ -0,0 +1,138 @@
+from app import App, load_config
+from emailmanager import EmailManager
+from notifier import NotificationAggregator
+from metrics import Metrics
+from sitegroup import SiteGroup
+from concurrent.futures import Future
+from pathlib import Path
+import bisect
+import hashlib
+import multiprocessing
+import queue
+import time
+
+class HashRing:
+    '''Assigns keys to workers with consistent hashing. A key always goes to the same worker for the same set of workers, and adding or removing a worker only moves the keys that belonged to it.'''
+
+    replicas = 100 # points on the ring per worker, which spreads keys more evenly
+
+    def __init__(self, workers: list[str]):
+        self.ring: list[tuple[int, str]] = sorted((self._hash(f'{worker}#{replica}'), worker) for worker in workers for replica in range(self.replicas))
+        self.hashes = [point for point, _ in self.ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big') # md5 is stable between runs, unlike hash()
+
+    def get_worker(self, key: str) -> str:
+        '''Returns the worker that owns the key: the first worker point clockwise from the key's hash.'''
+        index = bisect.bisect(self.hashes, self._hash(key)) % len(self.ring)
+        return self.ring[index][1]
+
+class EmailForwarder:
+    '''Stands in for the EmailManager inside a worker process. Emails are sent to the coordinator, which is the only process that sends them.'''
+
+    def __init__(self, worker_name: str, events: multiprocessing.Queue):
+        self.worker_name = worker_name
+        self.events = events
+
+    def send_email(self, to_address, to_name, subject, body, urgent: bool = False) -> Future:
+        self.events.put(('email', self.worker_name, to_address, to_name, subject, body, urgent))
+        future = Future()
+        future.set_result(None) # the coordinator owns delivery, so there is no SMTP response here
+        return future
+
+    def stop(self):
+        pass
+
+class WorkerApp(App):
+    '''An App that only runs the sites assigned to one worker, and reports every check back to the coordinator.'''
+
+    def __init__(self, worker_name: str, worker_names: list[str], events: multiprocessing.Queue):
+        self.worker_name = worker_name
+        self.events = events
+        hash_ring = HashRing(worker_names)
+        super().__init__(site_filter=lambda site: hash_ring.get_worker(site.name) == worker_name, email_manager=EmailForwarder(worker_name, events))
+        self.metrics.directory = self.metrics.directory / worker_name # each worker writes its own metrics files
+
+    def diagnostics_folder(self) -> Path:
+        '''Each worker saves diagnostics to its own folder, so one worker's retention never deletes a snapshot that another worker's record uses.'''
+        return super().diagnostics_folder() / self.worker_name
+
+    def check_site_group(self, site_group: SiteGroup) -> bool:
+        start_time = time.perf_counter()
+        group_enabled = super().check_site_group(site_group)
+        self.events.put(('check', self.worker_name, site_group.name, len(site_group.site_managers), time.perf_counter() - start_time))
+        return group_enabled
+
+def run_worker(worker_name: str, worker_names: list[str], events: multiprocessing.Queue):
+    '''The entry point of each worker process.'''
+    print(f'[{worker_name}] Starting.')
+    app = WorkerApp(worker_name, worker_names, events)
+    app.run()
+    events.put(('stopped', worker_name))
+
+class Coordinator:
+    '''Splits the site configs across worker processes, each with its own browsers, so checks can use every CPU core. Workers send their
+    results and emails back to the coordinator, which owns the only NotificationAggregator and EmailManager, so that no notification is
+    sent twice and notifications from every worker are merged into the same digests.'''
+
+    report_interval = 60 # seconds between throughput reports
+
+    def __init__(self, worker_count: int):
+        self.config = load_config()
+        self.worker_names = [f'worker-{index}' for index in range(worker_count)]
+        self.metrics = Metrics(Path(self.config.get('metrics', {}).get('directory', 'metrics')) / 'coordinator', self.config.get('metrics', {}).get('interval', 60))
+        self.email_manager = NotificationAggregator(EmailManager(self.config['smtpServer'], self.config['sendFrom'], self.metrics), self.config.get('notifications', {}))
+        context = multiprocessing.get_context('spawn') # forking a process with running threads isn't safe
+        self.events: multiprocessing.Queue = context.Queue()
+        self.processes = [context.Process(target=run_worker, args=(worker_name, self.worker_names, self.events), name=worker_name) for worker_name in self.worker_names]
+        self.check_counts: dict[str, int] = {worker_name: 0 for worker_name in self.worker_names}
+        self.check_times: dict[str, float] = {worker_name: 0.0 for worker_name in self.worker_names}
+
+    def run(self):
+        '''Starts the workers and handles their events until they have all stopped.'''
+        self.metrics.start()
+        for process in self.processes:
+            process.start()
+        last_report = time.monotonic()
+        try:
+            while any(process.is_alive() for process in self.processes) or not self.events.empty():
+                try:
+                    event = self.events.get(timeout=1)
+                except queue.Empty:
+                    event = None
+                if event is not None:
+                    self.handle_event(event)
+                if time.monotonic() - last_report >= self.report_interval:
+                    self.report(time.monotonic() - last_report)
+                    last_report = time.monotonic()
+        except KeyboardInterrupt:
+            print('[COORDINATOR] Stopping workers...')
+            for process in self.processes:
+                process.join(10)
+                if process.is_alive():
+                    process.terminate()
+        print('No workers are still running! The program will now exit.')
+        self.email_manager.stop()
+        self.metrics.stop()
+
+    def handle_event(self, event: tuple):
+        match event:
+            case ('email', worker_name, to_address, to_name, subject, body, urgent):
+                self.email_manager.send_email(to_address, to_name, subject, body, urgent)
+            case ('check', worker_name, group_name, site_count, duration):
+                self.check_counts[worker_name] += site_count
+                self.check_times[worker_name] += duration
+            case ('stopped', worker_name):
+                print(f'[COORDINATOR] {worker_name} has stopped.')
+            case _:
+                print(f'[COORDINATOR] Unknown event from worker: {event!r}')
+
+    def report(self, elapsed: float):
+        '''Prints how many site checks each worker has done since the last report.'''
+        total = sum(self.check_counts.values())
+        parts = [f'{worker_name}: {count} checks ({self.check_times[worker_name] / max(count, 1):.2f} seconds each)' for worker_name, count in self.check_counts.items()]
+        print(f'[COORDINATOR] {total / elapsed:.1f} site checks per second. ' + ', '.join(parts))
+        self.check_counts = {worker_name: 0 for worker_name in self.worker_names}
+        self.check_times = {worker_name: 0.0 for worker_name in self.worker_names}
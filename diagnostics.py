@@ -0,0 +1,140 @@
+from metrics import Metrics, APP_LABEL
+from pathlib import Path
+import datetime
+import gzip
+import hashlib
+import json
+import queue
+import threading
+import time
+
+class DiagnosticsWriter:
+    '''Saves diagnostic data in the background so that checks don't wait on the disk.
+
+    Each failure gets a small JSON record in the diagnostics folder. The page source and screenshot it points to are stored in
+    diagnostics/snapshots, named by a hash of their contents, so identical snapshots are only stored once. Page sources are
+    gzipped. Old records are deleted once they pass the age limit, or once the folder passes the size limit. The limits are checked at
+    startup, after each new record, and every hour in between.'''
+
+    retention_interval = 60 * 60 # seconds between retention checks while no new records are written
+
+    def __init__(self, folder: Path, metrics: Metrics, max_size: (int | float) = 0, max_age: (int | float) = 0):
+        self.folder = folder
+        self.snapshots_folder = folder / 'snapshots'
+        self.metrics = metrics
+        self.max_size = max_size * 1024 * 1024 # bytes, 0 means no limit
+        self.max_age = max_age * 24 * 60 * 60 # seconds, 0 means no limit
+        self.queue: queue.Queue[dict | None] = queue.Queue()
+        self.records: dict[Path, tuple[float, int, list[str]]] = {} # record path -> (time saved, size, snapshot file names)
+        self.snapshot_sizes: dict[str, int] = {}
+        self.total_size = 0 # bytes used by every record and snapshot
+        self.load_folder()
+        self.thread = threading.Thread(target=self.write_loop, name='DiagnosticsWriter', daemon=True)
+        self.thread.start()
+
+    def load_folder(self):
+        '''Creates the diagnostics folder if needed, and reads the records and snapshots that are already in it.'''
+        self.snapshots_folder.mkdir(parents=True, exist_ok=True)
+        for snapshot_path in self.snapshots_folder.iterdir():
+            self.snapshot_sizes[snapshot_path.name] = snapshot_path.stat().st_size
+            self.total_size += self.snapshot_sizes[snapshot_path.name]
+        for record_path in self.folder.glob('*.json'):
+            try:
+                record = json.loads(record_path.read_text())
+                snapshots = [Path(record[key]).name for key in ('pageSource', 'screenshot') if record.get(key)]
+            except (json.decoder.JSONDecodeError, KeyError, TypeError, OSError):
+                continue # not one of ours, leave it alone
+            stat = record_path.stat()
+            self.records[record_path] = (stat.st_mtime, stat.st_size, snapshots)
+            self.total_size += stat.st_size
+
+    def submit(self, site_name: str, url: str, screenshot: bytes | None, page_source: bytes) -> str:
+        '''Queues diagnostic data to be saved and returns the path of the record it will be saved as.'''
+        record_name = site_name + datetime.datetime.now().strftime('%m%d%Y-%H%M%S-%f') + '.json' # microseconds, so failures in the same second don't share a record
+        self.queue.put({'record_name': record_name, 'site': site_name, 'url': url, 'time': time.time(), 'screenshot': screenshot, 'page_source': page_source})
+        return (self.folder / record_name).as_posix()
+
+    def write_loop(self):
+        self.run_retention() # records may have passed the age limit while the program wasn't running
+        while True:
+            try:
+                item = self.queue.get(timeout=self.retention_interval)
+            except queue.Empty: # no new failures for a while, but records still need to age out
+                self.run_retention()
+                continue
+            if item is None:
+                return
+            try:
+                with self.metrics.time(APP_LABEL, 'diagnostics_write'):
+                    self.write(item)
+                    self.enforce_retention()
+            except Exception as error:
+                print(f"[DIAGNOSTICS ERROR] Diagnostic data save failed for site '{item['site']}'. Error message below:")
+                print(error)
+            else:
+                print(f"[DIAGNOSTICS] Diagnostic data for site '{item['site']}' saved to {(self.folder / item['record_name']).as_posix()}")
+
+    def write(self, item: dict):
+        record = {'site': item['site'], 'url': item['url'], 'time': datetime.datetime.fromtimestamp(item['time']).isoformat()}
+        snapshots = []
+        record['pageSource'] = self.write_snapshot(item['page_source'], '.html.gz', compress=True)
+        snapshots.append(Path(record['pageSource']).name)
+        if item['screenshot'] is not None: # pages fetched over HTTP have no screenshot
+            record['screenshot'] = self.write_snapshot(item['screenshot'], '.png', compress=False) # PNGs are already compressed
+            snapshots.append(Path(record['screenshot']).name)
+
+        record_path = self.folder / item['record_name']
+        record_text = json.dumps(record, indent=4)
+        record_path.write_text(record_text)
+        old_record = self.records.get(record_path) # the record being overwritten, if there was one with the same name
+        self.records[record_path] = (item['time'], len(record_text), snapshots)
+        self.total_size += len(record_text)
+        if old_record is not None:
+            self.total_size -= old_record[1]
+            self.delete_unused_snapshots(old_record[2])
+
+    def write_snapshot(self, data: bytes, suffix: str, compress: bool) -> str:
+        '''Saves the data under a name made from its hash, unless an identical snapshot is already saved. Returns its path relative to the diagnostics folder.'''
+        name = hashlib.sha256(data).hexdigest() + suffix
+        if name not in self.snapshot_sizes:
+            path = self.snapshots_folder / name
+            path.write_bytes(gzip.compress(data) if compress else data)
+            self.snapshot_sizes[name] = path.stat().st_size
+            self.total_size += self.snapshot_sizes[name]
+        return f'snapshots/{name}'
+
+    def run_retention(self):
+        try:
+            self.enforce_retention()
+        except Exception as error:
+            print(f"[DIAGNOSTICS ERROR] Deleting old diagnostic data failed. Error message: {error}")
+
+    def enforce_retention(self):
+        '''Deletes records that are too old, then the oldest records until the folder is under the size limit, along with any snapshots no record uses anymore.'''
+        oldest_first = sorted(self.records, key=lambda record_path: self.records[record_path][0])
+        if self.max_age:
+            cutoff = time.time() - self.max_age
+            while oldest_first and self.records[oldest_first[0]][0] < cutoff:
+                self.delete_record(oldest_first.pop(0))
+        if self.max_size:
+            while oldest_first and self.total_size > self.max_size:
+                self.delete_record(oldest_first.pop(0))
+
+    def delete_record(self, record_path: Path):
+        _, size, snapshots = self.records.pop(record_path)
+        record_path.unlink(missing_ok=True)
+        self.total_size -= size
+        self.delete_unused_snapshots(snapshots)
+
+    def delete_unused_snapshots(self, snapshots: list[str]):
+        '''Deletes any of the snapshots that no record uses anymore.'''
+        still_used = {name for _, _, names in self.records.values() for name in names}
+        for name in snapshots:
+            if name not in still_used and name in self.snapshot_sizes:
+                (self.snapshots_folder / name).unlink(missing_ok=True)
+                self.total_size -= self.snapshot_sizes.pop(name)
+
+    def stop(self, timeout: (int | float) = 30):
+        '''Saves any queued diagnostic data, then stops the writer thread.'''
+        self.queue.put(None)
+        self.thread.join(timeout)
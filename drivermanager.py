@@ -0,0 +1,168 @@
+from selenium import webdriver
+from selenium.common import exceptions as selenium_exceptions
+from browseroptions import BrowserOptions
+from metrics import Metrics, APP_LABEL
+from contextlib import contextmanager
+from typing import Iterator
+import queue
+import time
+
+try:
+    import psutil
+except ImportError: # psutil is only needed for the memory limit
+    psutil = None
+
+class DriverManager:
+    '''Owns a long-lived Firefox session. The same session is handed to every site manager, and is only restarted when it crashes or reaches its page or memory limit.'''
+
+    driver: webdriver.Firefox | None = None
+
+    def __init__(self, browser_options: BrowserOptions, metrics: Metrics, max_pages: int = 0, max_memory: (int | float) = 0):
+        self.browser_options = browser_options
+        self.metrics = metrics
+        self.max_pages = max_pages # restart after this many page loads, 0 means no limit
+        self.max_memory = max_memory # restart once the browser uses this many MB, 0 means no limit
+        self.page_count = 0
+        self.startup_count = 0
+        self.total_startup_time = 0.0
+        self.last_startup_time = 0.0
+
+        if self.max_memory and psutil is None:
+            print("WARNING: 'maxDriverMemory' is set but psutil is not installed. The driver memory limit will be ignored.")
+
+    def get_driver(self) -> webdriver.Firefox:
+        '''Returns the current driver, starting a new one if there isn't one running.'''
+        if self.driver is None:
+            self.start()
+        return self.driver
+
+    def start(self):
+        '''Starts a new Firefox session and records how long it took.'''
+        start_time = time.perf_counter()
+        with self.metrics.time(APP_LABEL, 'driver_startup'):
+            self.driver = webdriver.Firefox(options=self.browser_options.firefox_options()) # no implicit wait, pages wait explicitly for the one element they need
+            self.browser_options.apply(self.driver)
+        self.last_startup_time = time.perf_counter() - start_time
+        self.total_startup_time += self.last_startup_time
+        self.startup_count += 1
+        self.page_count = 0
+        print(f'[DRIVER] Started Firefox in {self.last_startup_time:.2f} seconds.')
+
+    def stop(self):
+        '''Quits the current driver if there is one.'''
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception as error:
+                print(f'[DRIVER] Error while quitting Firefox: {error}')
+            self.driver = None
+
+    def restart(self, reason: str):
+        '''Quits the current driver and starts a new one.'''
+        print(f'[DRIVER] Restarting Firefox: {reason}')
+        self.stop()
+        self.start()
+
+    def record_page_load(self):
+        '''Should be called every time a page is loaded with the driver.'''
+        self.page_count += 1
+
+    def average_startup_time(self) -> float:
+        if self.startup_count == 0:
+            return 0.0
+        return self.total_startup_time / self.startup_count
+
+    def memory_usage(self) -> float | None:
+        '''Returns the memory used by geckodriver and all of its Firefox processes in MB, or None if it can't be measured.'''
+        if psutil is None or self.driver is None:
+            return None
+        try:
+            process = psutil.Process(self.driver.service.process.pid)
+            processes = [process] + process.children(recursive=True)
+            return sum(child.memory_info().rss for child in processes) / (1024 * 1024)
+        except (psutil.Error, AttributeError):
+            return None
+
+    def health_check(self):
+        '''Checks that the driver is still alive and within its limits, restarting it if it isn't. Meant to be called between checks.'''
+        if self.driver is None:
+            return
+
+        try:
+            self.driver.window_handles # cheap call that fails if the browser has crashed
+        except selenium_exceptions.WebDriverException as error:
+            self.restart(f'browser is not responding ({type(error).__name__}).')
+            return
+
+        if self.max_pages and self.page_count >= self.max_pages:
+            self.restart(f'page limit of {self.max_pages} reached.')
+            return
+
+        if self.max_memory:
+            memory = self.memory_usage()
+            if memory is not None and memory >= self.max_memory:
+                self.restart(f'memory usage of {memory:.0f} MB exceeds limit of {self.max_memory} MB.')
+
+
+class DriverPool:
+    '''A fixed size pool of driver managers. Site managers borrow a driver from the pool while they run, so several sites can be checked at once.'''
+
+    def __init__(self, size: int, browser_options: BrowserOptions, metrics: Metrics, max_pages: int = 0, max_memory: (int | float) = 0):
+        self.driver_managers: list[DriverManager] = [DriverManager(browser_options, metrics, max_pages, max_memory) for _ in range(size)]
+        self.available: queue.Queue[DriverManager] = queue.Queue()
+        for driver_manager in self.driver_managers:
+            self.available.put(driver_manager)
+
+    @contextmanager
+    def borrow(self) -> Iterator[DriverManager]:
+        '''Waits for a free driver manager and lends it out until the with block exits. The driver is health checked before it goes back into the pool.'''
+        driver_manager = self.available.get()
+        try:
+            yield driver_manager
+        finally:
+            self.give_back(driver_manager)
+
+    @contextmanager
+    def borrow_lazily(self) -> Iterator['LazyDriver']:
+        '''Lends out a LazyDriver until the with block exits. A driver manager is only taken from the pool if the check asks for a driver.'''
+        lazy_driver = LazyDriver(self)
+        try:
+            yield lazy_driver
+        finally:
+            if lazy_driver.driver_manager is not None:
+                self.give_back(lazy_driver.driver_manager)
+
+    def give_back(self, driver_manager: DriverManager):
+        '''Health checks a borrowed driver manager and puts it back in the pool.'''
+        try:
+            driver_manager.health_check()
+        finally:
+            self.available.put(driver_manager)
+
+    @property
+    def total_startup_time(self) -> float:
+        return sum(driver_manager.total_startup_time for driver_manager in self.driver_managers)
+
+    def startup_time_saved(self, round_count: int) -> float:
+        '''Estimates how much time has been saved by not starting every browser on every round of checks.'''
+        saved_time = 0.0
+        for driver_manager in self.driver_managers:
+            if driver_manager.startup_count > 0:
+                saved_time += round_count * driver_manager.average_startup_time() - driver_manager.total_startup_time
+        return max(saved_time, 0)
+
+    def stop(self):
+        for driver_manager in self.driver_managers:
+            driver_manager.stop()
+
+class LazyDriver:
+    '''Borrows a driver manager from the pool the first time a driver is asked for, so checks that never need a browser don't take one.'''
+
+    def __init__(self, driver_pool: DriverPool):
+        self.driver_pool = driver_pool
+        self.driver_manager: DriverManager | None = None
+
+    def get_driver(self) -> webdriver.Firefox:
+        if self.driver_manager is None:
+            self.driver_manager = self.driver_pool.available.get()
+        return self.driver_manager.get_driver()
@@ -1,12 +1,33 @@
 import sys
-from envelopes import Envelope
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import Future
+from envelopes import Envelope, SMTP
+from metrics import Metrics, APP_LABEL
 
 class EmailManager:
+    '''Sends emails in the background. Emails are queued and delivered by a single thread that keeps one SMTP connection open and reuses it for every email.'''
 
-    def __init__(self, smtpOptions, senderOptions):
+    batch_size = 50 # most emails to take off the queue at once
+    retry_delay = 2 # seconds to wait before reconnecting after the connection fails, doubled after each failure in a row
+    max_retry_delay = 300 # the most seconds to wait between reconnects
+    give_up_after = 1800 # seconds the server can be unreachable before the waiting emails are failed
+    idle_timeout = 60 # seconds without any emails before the connection is closed
+    timeout = 30 # seconds to wait on the SMTP server before giving up, so a server that hangs can't block delivery forever
+
+    def __init__(self, smtpOptions, senderOptions, metrics: Metrics):
         self.verify_options(smtpOptions, senderOptions)
+        self.metrics = metrics
+        self.connection: SMTP | None = None
+        self.queue: queue.Queue[tuple[Envelope, Future] | None] = queue.Queue()
+        self.thread = threading.Thread(target=self.deliver_loop, name='EmailManager', daemon=True)
+        self.thread.start()
 
-    def send_email(self, to_address, to_name, subject, body):
+    def send_email(self, to_address, to_name, subject, body, urgent: bool = False) -> Future:
+        '''Queues an email and returns immediately. The returned future resolves to the SMTP response once the email has been sent.
+        Every email is sent as soon as possible, so urgent makes no difference here. It is accepted so this can stand in for a NotificationAggregator.'''
 
         email = Envelope(
             from_addr=(self.email_address, self.display_name),
@@ -15,7 +36,101 @@ class EmailManager:
             text_body=body
         )
 
-        return email.send(self.url, port=self.port, login=self.login, password=self.password, tls=True)
+        future = Future()
+        self.queue.put((email, future))
+        return future
+
+    def deliver_loop(self):
+        '''Runs on the delivery thread. Takes batches of emails off the queue and sends them over the shared connection. If the connection
+        fails, the emails that weren't sent wait, new emails are added to them, and the whole batch is sent once reconnecting works again.'''
+        pending: list[tuple[Envelope, Future]] = [] # emails taken off the queue that haven't been sent yet
+        failures = 0 # connection failures in a row
+        down_since: float | None = None
+        stopping = False
+        while True:
+            if not stopping:
+                wait = min(self.max_retry_delay, self.retry_delay * 2 ** (failures - 1)) if failures else self.idle_timeout
+                stopping = self.collect(pending, time.monotonic() + wait, wait_full_time=failures > 0)
+            if not pending:
+                if stopping:
+                    break
+                self.disconnect() # nothing to send for a while, so let the connection go
+                continue
+
+            error = self.deliver(pending)
+            if error is None:
+                failures, down_since = 0, None
+                continue
+            failures += 1
+            down_since = down_since if down_since is not None else time.monotonic()
+            if stopping or time.monotonic() - down_since >= self.give_up_after:
+                print(f'[EMAIL] The SMTP server has been unreachable for {time.monotonic() - down_since:.0f} seconds. Giving up on {len(pending)} emails.')
+                for email, future in pending:
+                    future.set_exception(error)
+                pending.clear()
+                failures, down_since = 0, None
+        self.disconnect()
+
+    def collect(self, pending: list[tuple[Envelope, Future]], deadline: float, wait_full_time: bool) -> bool:
+        '''Adds queued emails to pending, up to batch_size. Waits until the deadline for the first one, or the whole time if
+        wait_full_time is set, which is used to back off while the connection is down. Returns True once stop() has been called.'''
+        while len(pending) < self.batch_size:
+            if wait_full_time or len(pending) == 0:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            else:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if item is None: # stop() was called, so send what's left and exit
+                return True
+            pending.append(item)
+        return False
+
+    def deliver(self, pending: list[tuple[Envelope, Future]]) -> Exception | None:
+        '''Sends pending emails in order, removing each one once it is sent. Emails the server refuses are failed straight away.
+        If the connection fails, the rest are left in pending and the error is returned.'''
+        while pending:
+            email, future = pending[0]
+            try:
+                if self.connection is None:
+                    self.connection = SMTP(self.url, port=self.port, login=self.login, password=self.password, tls=self.tls, timeout=self.timeout)
+                with self.metrics.time(APP_LABEL, 'smtp_send'):
+                    result = self.connection.send(email) # connects and logs in the first time, then reuses the connection
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as error: # the server is fine, but won't take this email
+                print(f"[EMAIL] The server refused the email to {email.to_addr}. Error message: {error}")
+                pending.pop(0)
+                future.set_exception(error)
+            except Exception as error:
+                print(f"[EMAIL] Failed to send email to {email.to_addr}, {len(pending)} emails are waiting for the connection. Error message: {error}")
+                self.disconnect()
+                return error
+            else:
+                pending.pop(0)
+                future.set_result(result)
+        return None
+
+    def disconnect(self):
+        '''Closes the current connection so the next email opens a new one.'''
+        connection, self.connection = self.connection, None
+        smtp = getattr(connection, '_conn', None) # the smtplib connection inside envelopes' SMTP, None if it never connected
+        if smtp is None:
+            return
+        try:
+            smtp.quit() # says goodbye to the server and closes the socket
+        except Exception: # the connection is already broken, so just close the socket
+            smtp.close()
+
+    def stop(self, timeout: (int | float) = 30):
+        '''Sends any queued emails, then stops the delivery thread.'''
+        self.queue.put(None)
+        self.thread.join(timeout)
 
     def verify_options(self, smtp_options, sender_options):
         if not smtp_options.get('url'):
@@ -33,6 +148,7 @@ class EmailManager:
         else:
             self.url = smtp_options['url']
             self.port = smtp_options['port']
+            self.tls = smtp_options.get('tls', True) # STARTTLS, only meant to be turned off for local test servers
             self.login = smtp_options['login']
             self.password = smtp_options['password']
         
@@ -0,0 +1,56 @@
+import requests
+from requests.adapters import HTTPAdapter
+from lxml import html as lxml_html
+
+class HTTPFetcher:
+    '''Fetches pages over plain HTTP without starting a browser. Connections are pooled and kept alive between checks.'''
+
+    user_agent = 'Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0'
+
+    def __init__(self, pool_size: int = 10, timeout: (int | float) = 10):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = self.user_agent
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch(self, url: str) -> bytes:
+        '''Gets the raw page source for the url. Raises a requests exception if the request fails.'''
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content # bytes, so lxml can work out the encoding from the page itself
+
+    def parse(self, page_source: bytes, url: str) -> lxml_html.HtmlElement:
+        '''Parses the page source so that it can be searched with XPaths.'''
+        return lxml_html.fromstring(page_source, base_url=url)
+
+    def find_element_html(self, document: lxml_html.HtmlElement, xpath: str) -> str | None:
+        '''Evaluates the XPath against the parsed page and returns the innerHTML of the first match, or None if nothing matches.'''
+        results = document.xpath(xpath)
+        if not isinstance(results, list): # XPaths like count() return a single value
+            return str(results)
+        for result in results:
+            if isinstance(result, str): # XPaths ending in text() or an attribute return strings
+                return str(result)
+            if isinstance(result, lxml_html.HtmlElement):
+                return inner_html(result)
+        return None
+
+    def close(self):
+        self.session.close()
+
+RAW_TEXT_TAGS = {'script', 'style', 'xmp', 'iframe', 'noembed', 'noframes', 'plaintext', 'noscript'} # browsers don't escape the text inside these
+
+def escape_text(text: str) -> str:
+    '''Escapes text the way browsers do when serializing innerHTML.'''
+    return text.replace('&', '&amp;').replace('\u00a0', '&nbsp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def inner_html(element: lxml_html.HtmlElement) -> str:
+    '''Returns the markup inside an element, the same as the innerHTML attribute in a browser, so compare values match the same way with every engine.'''
+    text = element.text or ''
+    if element.tag not in RAW_TEXT_TAGS:
+        text = escape_text(text)
+    # tostring includes the text after each child and escapes &, < and >, but writes no-break spaces as they are rather than as &nbsp;
+    children = [lxml_html.tostring(child, encoding='unicode').replace('\u00a0', '&nbsp;') for child in element]
+    return text + ''.join(children)
@@ -0,0 +1,66 @@
+from collections import deque
+import html
+import re
+
+TAG_PATTERN = re.compile(r'<[^>]*>')
+PRICE_PATTERN = re.compile(r'\d+(?:[.,\u00a0\u202f]\d+)*') # digits with thousands and decimal separators, like 1,299.99, 1.299,99 or 1 299,99 with a no-break space
+
+class PhraseMatcher:
+    '''Finds the first of any number of phrases in a single pass over the text, using an Aho-Corasick automaton, so the time a search takes
+    doesn't grow with the number of phrases.'''
+
+    def __init__(self, phrases: list[str]):
+        self.transitions: list[dict[str, int]] = [{}] # state -> next state for each character, state 0 is the start
+        self.fail: list[int] = [0] # state -> the state for the longest suffix that is also the start of a phrase
+        self.match_lengths: list[int] = [0] # state -> length of a phrase that ends at this state, 0 if none does
+        for phrase in phrases:
+            state = 0
+            for char in phrase:
+                if char not in self.transitions[state]:
+                    self.transitions[state][char] = len(self.transitions)
+                    self.transitions.append({})
+                    self.fail.append(0)
+                    self.match_lengths.append(0)
+                state = self.transitions[state][char]
+            self.match_lengths[state] = len(phrase)
+
+        # set the fail links breadth first, so shorter suffixes are always done before the states that fall back to them
+        states = deque(self.transitions[0].values())
+        while states:
+            state = states.popleft()
+            for char, next_state in self.transitions[state].items():
+                states.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.transitions[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.transitions[fail].get(char, 0)
+                if not self.match_lengths[next_state]: # a phrase that ends inside this one
+                    self.match_lengths[next_state] = self.match_lengths[self.fail[next_state]]
+
+    def search(self, text: str) -> int:
+        '''Returns the index where the first phrase found in the text starts, or -1 if none of the phrases are in it.'''
+        transitions, fail, match_lengths = self.transitions, self.fail, self.match_lengths
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in transitions[state]:
+                state = fail[state]
+            state = transitions[state].get(char, 0)
+            if match_lengths[state]:
+                return index - match_lengths[state] + 1
+        return -1
+
+def element_text(element_html: str) -> str:
+    '''Returns the text of innerHTML, without tags and with entities like &nbsp; decoded.'''
+    return html.unescape(TAG_PATTERN.sub(' ', element_html)).strip()
+
+def parse_price(text: str) -> float | None:
+    '''Returns the first price in the text, or None if there isn't one. A separator followed by exactly three digits is taken to group
+    thousands, and any other separator is taken to be the decimal point, so both 1,299.99 and 1.299,99 are read as 1299.99.'''
+    match = PRICE_PATTERN.search(text)
+    if match is None:
+        return None
+    number = match.group().replace('\u00a0', '').replace('\u202f', '')
+    decimal_index = max(number.rfind('.'), number.rfind(','))
+    if decimal_index == -1 or len(number) - decimal_index - 1 == 3:
+        return float(number.replace('.', '').replace(',', ''))
+    return float(number[:decimal_index].replace('.', '').replace(',', '') + '.' + number[decimal_index + 1:])
@@ -0,0 +1,158 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+import datetime
+import json
+import threading
+import time
+
+APP_LABEL = 'app' # used as the site label for stages that don't belong to a site, like starting Firefox or sending email
+
+class Histogram:
+    '''A histogram with fixed buckets, so it uses the same amount of memory no matter how many durations are recorded.'''
+
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) # upper bounds in seconds
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1) # the last count is for durations above the highest bucket
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, duration: float):
+        index = 0
+        while index < len(self.buckets) and duration > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += duration
+        self.max = max(self.max, duration)
+
+    def quantile(self, quantile: float) -> float:
+        '''Estimates a quantile as the upper bound of the bucket it falls in, capped at the largest duration seen.'''
+        if self.count == 0:
+            return 0.0
+        target = quantile * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+        return self.max
+
+class Metrics:
+    '''Records how long each stage of each site's checks takes, and whether it succeeded. Results are written to a Prometheus text file and a JSON summary every interval.'''
+
+    def __init__(self, directory: Path, interval: (int | float)):
+        self.directory = directory
+        self.interval = interval # seconds between writes, 0 means never write
+        self.lock = threading.Lock()
+        self.histograms: dict[tuple[str, str], Histogram] = {}
+        self.outcomes: dict[tuple[str, str, str], int] = {}
+        self.round_durations: dict[str, float] = {} # total check time per site since the last round was logged
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def observe(self, site: str, stage: str, duration: float, outcome: str = 'success'):
+        '''Records one duration for a site and stage.'''
+        with self.lock:
+            if (site, stage) not in self.histograms:
+                self.histograms[(site, stage)] = Histogram()
+            self.histograms[(site, stage)].observe(duration)
+            self.outcomes[(site, stage, outcome)] = self.outcomes.get((site, stage, outcome), 0) + 1
+            if stage == 'check':
+                self.round_durations[site] = self.round_durations.get(site, 0.0) + duration
+
+    @contextmanager
+    def time(self, site: str, stage: str) -> Iterator[None]:
+        '''Times the with block. The outcome is recorded as the exception's name if one is raised.'''
+        start_time = time.perf_counter()
+        outcome = 'success'
+        try:
+            yield
+        except BaseException as error:
+            outcome = type(error).__name__
+            raise
+        finally:
+            self.observe(site, stage, time.perf_counter() - start_time, outcome)
+
+    def pop_slowest_sites(self, count: int = 5) -> list[tuple[str, float]]:
+        '''Returns the sites that spent the most time checking since the last call, and starts counting again.'''
+        with self.lock:
+            round_durations = self.round_durations
+            self.round_durations = {}
+        return sorted(round_durations.items(), key=lambda item: item[1], reverse=True)[:count]
+
+    def start(self):
+        '''Starts writing the metrics files in the background.'''
+        if self.interval <= 0:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True) # workers' folders are inside the main metrics folder, and may be created at the same time
+        self.thread = threading.Thread(target=self.write_loop, name='Metrics', daemon=True)
+        self.thread.start()
+
+    def write_loop(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        '''Stops the background writer, and writes the metrics one last time.'''
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.write()
+
+    def write(self):
+        try:
+            self._write_file(self.directory / 'metrics.prom', self.prometheus_text())
+            self._write_file(self.directory / 'metrics.json', json.dumps(self.summary(), indent=4))
+        except OSError as error:
+            print(f'[METRICS ERROR] Failed to write metrics. Error message: {error}')
+
+    def _write_file(self, path: Path, text: str):
+        '''Writes to a temporary file first, so anything reading the file never sees half of it.'''
+        temporary_path = path.with_suffix(path.suffix + '.tmp')
+        temporary_path.write_text(text)
+        temporary_path.replace(path)
+
+    def prometheus_text(self) -> str:
+        '''Returns every histogram and outcome count in the Prometheus text format.'''
+        lines = [
+            '# HELP stocknotifier_stage_duration_seconds Time spent in each stage of checking a site.',
+            '# TYPE stocknotifier_stage_duration_seconds histogram',
+        ]
+        with self.lock:
+            for (site, stage), histogram in sorted(self.histograms.items()):
+                labels = f'site="{_escape_label(site)}",stage="{_escape_label(stage)}"'
+                cumulative = 0
+                for bucket, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'stocknotifier_stage_duration_seconds_bucket{{{labels},le="{bucket}"}} {cumulative}')
+                lines.append(f'stocknotifier_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'stocknotifier_stage_duration_seconds_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'stocknotifier_stage_duration_seconds_count{{{labels}}} {histogram.count}')
+            lines.append('# HELP stocknotifier_stage_total Number of times each stage finished, by outcome.')
+            lines.append('# TYPE stocknotifier_stage_total counter')
+            for (site, stage, outcome), count in sorted(self.outcomes.items()):
+                lines.append(f'stocknotifier_stage_total{{site="{_escape_label(site)}",stage="{_escape_label(stage)}",outcome="{_escape_label(outcome)}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> dict:
+        '''Returns a summary of every histogram that can be saved as JSON.'''
+        stages = []
+        with self.lock:
+            for (site, stage), histogram in sorted(self.histograms.items()):
+                stages.append({
+                    'site': site,
+                    'stage': stage,
+                    'count': histogram.count,
+                    'mean': histogram.sum / histogram.count if histogram.count else 0.0,
+                    'p50': histogram.quantile(0.5),
+                    'p95': histogram.quantile(0.95),
+                    'max': histogram.max,
+                    'outcomes': {outcome: count for (outcome_site, outcome_stage, outcome), count in self.outcomes.items() if (outcome_site, outcome_stage) == (site, stage)},
+                })
+        return {'generated': datetime.datetime.now().isoformat(), 'stages': stages}
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
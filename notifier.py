@@ -0,0 +1,156 @@
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from emailmanager import EmailManager
+
+class TokenBucket:
+    '''Allows `limit` sends per `period` seconds, with bursts of up to `limit`. Tokens can be overdrawn by urgent sends, which holds back later ones.'''
+
+    def __init__(self, limit: (int | float), period: (int | float)):
+        self.capacity = limit
+        self.rate = limit / period # tokens added per second
+        self.tokens = float(limit)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until_available(self, now: float) -> float:
+        '''How many seconds until a token can be taken, or 0 if one can be taken now.'''
+        self.refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self, now: float):
+        self.refill(now)
+        self.tokens -= 1
+
+class PendingDigest:
+    '''The notifications waiting to be sent to one recipient.'''
+
+    def __init__(self, to_address: str, to_name: str, due: float):
+        self.to_address = to_address
+        self.to_name = to_name
+        self.due = due # when the digest should be sent, as a time.monotonic() value
+        self.urgent = False
+        self.notifications: list[tuple[str, str]] = [] # (subject, body)
+        self.futures: list[Future] = []
+
+class NotificationAggregator:
+    '''Sits between the site managers and the EmailManager, and has the same send_email method. Notifications for the same recipient are
+    collected for a short window and sent as one digest, and sends are rate limited per recipient and in total, so a mass restock doesn't
+    turn into dozens of separate emails. Urgent notifications, like the first restock alert for a site, are sent within alertDelay
+    seconds, even if that goes over the rate limits.'''
+
+    def __init__(self, email_manager: EmailManager, notification_config: dict):
+        for parameter in ('digestWindow', 'alertDelay', 'perRecipientPerHour', 'globalPerMinute'):
+            if type(notification_config.get(parameter, 0)) not in (int, float) or notification_config.get(parameter, 0) < 0:
+                print(f"ERROR: notifications config is misconfigured. '{parameter}' must be a number that is not negative. Please check config.json.")
+                sys.exit()
+        self.email_manager = email_manager
+        self.digest_window: (int | float) = notification_config.get('digestWindow', 10) # seconds to collect notifications for a recipient before sending them
+        self.alert_delay: (int | float) = min(self.digest_window, notification_config.get('alertDelay', 3)) # most seconds an urgent notification waits
+        self.per_recipient_limit: (int | float) = notification_config.get('perRecipientPerHour', 20) # 0 means no limit
+        self.global_limit: (int | float) = notification_config.get('globalPerMinute', 30) # 0 means no limit
+        self.global_bucket = TokenBucket(self.global_limit, 60) if self.global_limit else None
+        self.recipient_buckets: dict[str, TokenBucket] = {}
+        self.pending: dict[str, PendingDigest] = {} # recipient address -> notifications waiting to be sent to them
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.send_loop, name='NotificationAggregator', daemon=True)
+        self.thread.start()
+
+    def send_email(self, to_address, to_name, subject, body, urgent: bool = False) -> Future:
+        '''Queues a notification and returns immediately. The returned future resolves to the SMTP response once the digest it is part of has been sent.'''
+        future = Future()
+        now = time.monotonic()
+        with self.condition:
+            key = to_address.lower()
+            if key not in self.pending:
+                self.pending[key] = PendingDigest(to_address, to_name, now + self.digest_window)
+            digest = self.pending[key]
+            digest.notifications.append((subject, body))
+            digest.futures.append(future)
+            if urgent:
+                digest.urgent = True
+                digest.due = min(digest.due, now + self.alert_delay)
+            self.condition.notify()
+        return future
+
+    def send_loop(self):
+        '''Runs on the aggregator thread. Sends each digest once it is due and the rate limits allow it.'''
+        with self.condition:
+            while not self.stopping:
+                wait_time = self.send_due_digests(time.monotonic())
+                self.condition.wait(wait_time)
+            for key, digest in list(self.pending.items()): # send everything that is left, whatever the limits
+                del self.pending[key]
+                self.send_digest(key, digest, time.monotonic())
+
+    def send_due_digests(self, now: float) -> float | None:
+        '''Sends every digest that is due and allowed by the rate limits. Returns how long to wait before one of the others can be sent, or None if nothing is pending.'''
+        wait_time = None
+        for key, digest in list(self.pending.items()):
+            if digest.due > now:
+                delay = digest.due - now
+            else:
+                delay = 0.0 if digest.urgent else self.rate_limit_delay(key, now)
+                if delay == 0.0:
+                    del self.pending[key]
+                    self.send_digest(key, digest, time.monotonic())
+                    continue
+            wait_time = delay if wait_time is None else min(wait_time, delay)
+        return wait_time
+
+    def rate_limit_delay(self, key: str, now: float) -> float:
+        '''How many seconds until the recipient can be sent another email without going over either rate limit.'''
+        delay = 0.0
+        recipient_bucket = self.get_recipient_bucket(key)
+        if recipient_bucket is not None:
+            delay = recipient_bucket.time_until_available(now)
+        if self.global_bucket is not None:
+            delay = max(delay, self.global_bucket.time_until_available(now))
+        return delay
+
+    def get_recipient_bucket(self, key: str) -> TokenBucket | None:
+        '''Returns the rate limit for a recipient, creating it the first time the recipient is seen. Returns None if there is no per recipient limit.'''
+        if not self.per_recipient_limit:
+            return None
+        if key not in self.recipient_buckets:
+            self.recipient_buckets[key] = TokenBucket(self.per_recipient_limit, 60 * 60)
+        return self.recipient_buckets[key]
+
+    def send_digest(self, key: str, digest: PendingDigest, now: float):
+        '''Hands a digest to the EmailManager, merging its notifications into one email if there is more than one.'''
+        recipient_bucket = self.get_recipient_bucket(key)
+        if recipient_bucket is not None:
+            recipient_bucket.take(now)
+        if self.global_bucket is not None:
+            self.global_bucket.take(now)
+
+        if len(digest.notifications) == 1:
+            subject, body = digest.notifications[0]
+        else:
+            subject = f'Stock Notifier: {len(digest.notifications)} updates'
+            body = '\n\n'.join(f'{notification_subject}\n{notification_body}' for notification_subject, notification_body in digest.notifications)
+            print(f'[EMAIL] Merged {len(digest.notifications)} notifications for {digest.to_address} into one digest.')
+        email_future = self.email_manager.send_email(digest.to_address, digest.to_name, subject, body)
+        email_future.add_done_callback(lambda email_future, futures=digest.futures: self.resolve(email_future, futures))
+
+    @staticmethod
+    def resolve(email_future: Future, futures: list[Future]):
+        '''Passes the result of sending a digest on to every notification in it.'''
+        for future in futures:
+            if email_future.exception() is not None:
+                future.set_exception(email_future.exception())
+            else:
+                future.set_result(email_future.result())
+
+    def stop(self, timeout: (int | float) = 30):
+        '''Sends every pending digest straight away, then stops the EmailManager once they have been sent.'''
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join(timeout)
+        self.email_manager.stop(timeout)
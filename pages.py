@@ -0,0 +1,176 @@
+from selenium import webdriver
+from selenium.common import exceptions as selenium_exceptions
+from selenium.webdriver.support.wait import WebDriverWait
+from httpfetcher import HTTPFetcher
+from matching import PhraseMatcher
+from typing import Callable, NamedTuple
+from lxml import etree as lxml_etree
+import requests
+from urllib.parse import urldefrag
+
+EXCERPT_LENGTH = 100 # how many characters of the element's text are returned with a check
+
+# Finds the element and checks it inside the page, so only a small result is sent back over WebDriver instead of the element's whole innerHTML.
+# Returns null if the element doesn't exist yet, which makes WebDriverWait keep polling. It also returns null while the browser still shows
+# the page marked by MARK_PREVIOUS_PAGE_SCRIPT, or the new page is still being parsed, so a check never reads the wrong or a half loaded page.
+CHECK_CONTAINS_SCRIPT = '''
+const [xpath, compareValues, excerptLength] = arguments;
+if (window.stockNotifierPreviousPage || document.readyState === 'loading') {
+    return null;
+}
+const node = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+if (node === null) {
+    return null;
+}
+const html = node.nodeType === Node.ELEMENT_NODE ? node.innerHTML : node.textContent;
+let index = -1; // where the earliest compare value starts
+for (const compareValue of compareValues) {
+    const found = html.indexOf(compareValue);
+    if (found !== -1 && (index === -1 || found < index)) {
+        index = found;
+    }
+}
+const start = Math.max(0, index - Math.floor(excerptLength / 2));
+return {
+    found: true,
+    matched: index !== -1,
+    excerpt: html.substring(start, start + excerptLength),
+    html: excerptLength === null ? html : null
+};
+'''
+
+DriverSource = Callable[[], webdriver.Firefox] # returns the driver to use, only borrowing one from the pool the first time it is called
+
+# Marks the page that is open before loading a new one. Each page gets a new window object, so the mark disappears once the new page has replaced it.
+# This matters when pageLoadStrategy is 'none', where driver.get() can return before the new page is in place, and the last site's page might have the same XPath.
+MARK_PREVIOUS_PAGE_SCRIPT = 'window.stockNotifierPreviousPage = true;'
+
+class ElementCheck(NamedTuple):
+    '''The result of checking an element for a compare value.'''
+    matched: bool # whether any of the compare values are in the element's innerHTML
+    excerpt: str # a short piece of the innerHTML, around the compare value that was found if there was one
+
+def html_excerpt(html: str, index: int) -> str:
+    '''Returns a short piece of the innerHTML, around the index if it isn't -1, the same way CHECK_CONTAINS_SCRIPT does in the browser.'''
+    start = max(0, index - EXCERPT_LENGTH // 2)
+    return html[start:start + EXCERPT_LENGTH]
+
+def check_html_contains(html: str, compare_values: list[str], phrase_matcher: PhraseMatcher | None = None) -> ElementCheck:
+    '''Checks innerHTML that has already been fetched, the same way CHECK_CONTAINS_SCRIPT does in the browser. Several compare values are searched for in one pass with the phrase matcher, if one is given.'''
+    if phrase_matcher is not None:
+        index = phrase_matcher.search(html)
+    else:
+        index = min((found for found in (html.find(compare_value) for compare_value in compare_values) if found != -1), default=-1)
+    return ElementCheck(index != -1, html_excerpt(html, index))
+
+class BrowserPage:
+    '''A page loaded in the browser. Loading happens once, when the page is created, and any number of elements can then be read from it.'''
+
+    wait_time = 10 # seconds to wait for an element to show up before giving up
+
+    def __init__(self, driver: webdriver.Firefox, url: str):
+        self.driver = driver
+        self.url = url
+        if urldefrag(url).fragment and urldefrag(self.driver.current_url).url == urldefrag(url).url:
+            self.driver.get('about:blank') # only changing the #fragment scrolls the same document instead of loading a new one, so the mark would never be cleared
+        self.driver.execute_script(MARK_PREVIOUS_PAGE_SCRIPT)
+        try:
+            self.driver.get(url) # gets the page
+        except selenium_exceptions.TimeoutException: # the page load timeout was hit, but the element might already be there
+            print(f"Page '{url}' took longer than the page load timeout. Stopping the load and checking what has loaded so far.")
+            self.driver.execute_script('window.stop();')
+
+    def _run_check_script(self, xpath: str, compare_values: list[str], excerpt_length: int | None) -> dict:
+        '''Runs CHECK_CONTAINS_SCRIPT, waiting for just this element to appear. Raises NoSuchElementException if it never does.'''
+        try:
+            return WebDriverWait(self.driver, self.wait_time, poll_frequency=0.25).until(
+                lambda driver: driver.execute_script(CHECK_CONTAINS_SCRIPT, xpath, compare_values, excerpt_length)
+            )
+        except selenium_exceptions.TimeoutException:
+            raise selenium_exceptions.NoSuchElementException(f'No element matches {xpath} after waiting {self.wait_time} seconds')
+
+    def element_html(self, xpath: str) -> str:
+        '''Returns the innerHTML of the element. Raises NoSuchElementException if it can't be found.'''
+        return self._run_check_script(xpath, [], None)['html']
+
+    def check_contains(self, xpath: str, compare_values: list[str], phrase_matcher: PhraseMatcher | None = None) -> ElementCheck:
+        '''Checks whether the element's innerHTML contains any of the compare values, inside the browser. Raises NoSuchElementException if it can't be found.'''
+        result = self._run_check_script(xpath, compare_values, EXCERPT_LENGTH) # the browser searches natively, so the phrase matcher isn't needed
+        return ElementCheck(result['matched'], result['excerpt'])
+
+    def snapshot(self) -> tuple[bytes | None, bytes]:
+        '''Returns a screenshot and the page source, for saving diagnostic data.'''
+        return self.driver.get_screenshot_as_png(), self.driver.page_source.encode()
+
+class HTTPPage:
+    '''A page fetched over HTTP without a browser. The HTML is parsed once and shared by every element lookup.'''
+
+    def __init__(self, http_fetcher: HTTPFetcher, url: str):
+        self.http_fetcher = http_fetcher
+        self.url = url
+        self.page_source = http_fetcher.fetch(url)
+        self.document = http_fetcher.parse(self.page_source, url)
+
+    def element_html(self, xpath: str) -> str:
+        '''Returns the innerHTML of the element. Raises NoSuchElementException if it can't be found.'''
+        text = self.http_fetcher.find_element_html(self.document, xpath)
+        if text is None:
+            raise selenium_exceptions.NoSuchElementException(f'No element matches {xpath} in the HTML returned by {self.url}')
+        return text
+
+    def check_contains(self, xpath: str, compare_values: list[str], phrase_matcher: PhraseMatcher | None = None) -> ElementCheck:
+        '''Checks whether the element's innerHTML contains any of the compare values. Raises NoSuchElementException if it can't be found.'''
+        return check_html_contains(self.element_html(xpath), compare_values, phrase_matcher)
+
+    def snapshot(self) -> tuple[bytes | None, bytes]:
+        '''Returns the page source for saving diagnostic data. There is no screenshot since no browser was used.'''
+        return None, self.page_source
+
+class AutoPage:
+    '''A page that is fetched over HTTP first, and only loaded in the browser if an element can't be found in the HTTP response.
+    The browser is only borrowed from the pool when that happens, so checks that work over HTTP never wait for one.'''
+
+    def __init__(self, http_fetcher: HTTPFetcher, get_driver: DriverSource, url: str):
+        self.get_driver = get_driver
+        self.url = url
+        self.browser_page: BrowserPage | None = None
+        try:
+            self.http_page: HTTPPage | None = HTTPPage(http_fetcher, url)
+        except (requests.RequestException, lxml_etree.LxmlError) as error: # e.g. the request failed, or the page came back empty
+            print(f"Page '{url}' could not be fetched over HTTP ({type(error).__name__}). Falling back to the browser.")
+            self.http_page = None
+
+    def element_html(self, xpath: str) -> str:
+        '''Returns the innerHTML of the element, loading the page in the browser if the element isn't in the HTTP response.'''
+        if self.http_page is not None:
+            try:
+                return self.http_page.element_html(xpath)
+            except selenium_exceptions.NoSuchElementException:
+                print(f"Element '{xpath}' was not found on '{self.url}' over HTTP. Falling back to the browser.")
+        return self.get_browser_page().element_html(xpath)
+
+    def check_contains(self, xpath: str, compare_values: list[str], phrase_matcher: PhraseMatcher | None = None) -> ElementCheck:
+        '''Checks whether the element's innerHTML contains any of the compare values, loading the page in the browser if the element isn't in the HTTP response.'''
+        if self.http_page is not None:
+            try:
+                return self.http_page.check_contains(xpath, compare_values, phrase_matcher)
+            except selenium_exceptions.NoSuchElementException:
+                print(f"Element '{xpath}' was not found on '{self.url}' over HTTP. Falling back to the browser.")
+        return self.get_browser_page().check_contains(xpath, compare_values, phrase_matcher)
+
+    def get_browser_page(self) -> BrowserPage:
+        '''Loads the page in the browser the first time it's needed.'''
+        if self.browser_page is None:
+            self.browser_page = BrowserPage(self.get_driver(), self.url)
+        return self.browser_page
+
+    def snapshot(self) -> tuple[bytes | None, bytes]:
+        '''Returns diagnostic data from the browser if the page was loaded there, otherwise from the HTTP response.'''
+        if self.browser_page is not None:
+            return self.browser_page.snapshot()
+        if self.http_page is not None:
+            return self.http_page.snapshot()
+        driver = self.get_driver() # the browser page failed to load, so save whatever state the browser was left in
+        return driver.get_screenshot_as_png(), driver.page_source.encode()
+
+Page = BrowserPage | HTTPPage | AutoPage
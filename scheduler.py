@@ -0,0 +1,45 @@
+from sitegroup import SiteGroup
+import heapq
+import itertools
+import random
+import threading
+import time
+
+class Scheduler:
+    '''Keeps track of when each site group is next due to be checked. Groups are held in a heap ordered by due time, so the next group to check is always on top.'''
+
+    def __init__(self, default_interval: (int | float)):
+        self.default_interval = default_interval # used for groups where no site sets an interval
+        self.heap: list[tuple[float, int, SiteGroup]] = []
+        self.counter = itertools.count() # breaks ties between groups that are due at the same time
+        self.condition = threading.Condition()
+
+    def schedule(self, site_group: SiteGroup, delay: (int | float) = 0):
+        '''Schedules the group to be checked after the given delay in seconds.'''
+        with self.condition:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.counter), site_group))
+            self.condition.notify()
+
+    def schedule_next(self, site_group: SiteGroup) -> float:
+        '''Schedules the next check for a group using its interval and jitter, or its backoff delay if it is failing. Returns the delay in seconds.'''
+        delay = site_group.retry_delay()
+        interval = site_group.interval if site_group.interval is not None else self.default_interval
+        if delay is None:
+            delay = interval + random.uniform(0, site_group.jitter)
+        elif site_group.breaker_open: # an open breaker only probes, so it never checks more often than the normal interval
+            delay = max(delay, interval)
+        self.schedule(site_group, delay)
+        return delay
+
+    def next_due(self, timeout: (int | float)) -> SiteGroup | None:
+        '''Waits until a group is due and removes it from the schedule. Returns None if no group became due within the timeout.'''
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self.heap and self.heap[0][0] <= now:
+                    return heapq.heappop(self.heap)[2]
+                if now >= deadline:
+                    return None
+                wait_until = min(self.heap[0][0], deadline) if self.heap else deadline
+                self.condition.wait(wait_until - now)
@@ -0,0 +1,89 @@
+from sitemanager import SiteManager
+from circuitbreaker import CircuitBreaker
+from pages import DriverSource
+from selenium.common import exceptions as selenium_exceptions
+import requests
+import threading
+
+def is_host_error(error: Exception) -> bool:
+    '''Whether a page load error means the host itself is in trouble: it couldn't be reached, it timed out, or it answered with a server
+    error. Errors like a 404 only count against the sites on that page, so one broken page doesn't slow down every page on its host.'''
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code >= 500
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, selenium_exceptions.TimeoutException)):
+        return True
+    if isinstance(error, selenium_exceptions.WebDriverException): # Firefox shows its network error page when a host can't be reached
+        return 'about:neterror' in (error.msg or '')
+    return False
+
+class SiteGroup:
+    '''A group of site managers that watch the same page with the same engine. The page is loaded once per check, and every site manager in the group runs its test against it. Each site manager keeps its own state and recipients.'''
+
+    def __init__(self, url: str, engine: str, host_breaker: CircuitBreaker):
+        self.url = url
+        self.engine = engine
+        self.host_breaker = host_breaker # shared by every group on the same host
+        self.fell_back = False # whether the last auto check needed the browser, so the next one is run on a browser thread
+        self.site_managers: list[SiteManager] = []
+        self.lock = threading.Lock() # sites can be added by a reload while the group is being checked
+
+    def add(self, site_manager: SiteManager):
+        with self.lock:
+            self.site_managers.append(site_manager)
+
+    @property
+    def name(self) -> str:
+        return ', '.join(site_manager.name for site_manager in self.site_managers)
+
+    @property
+    def interval(self) -> (int | float) | None:
+        '''The shortest interval set by any site in the group, or None if none of them set one.'''
+        return min((site_manager.interval for site_manager in self.site_managers if site_manager.interval is not None), default=None)
+
+    @property
+    def jitter(self) -> (int | float):
+        return min((site_manager.jitter for site_manager in self.site_managers), default=0)
+
+    def retry_delay(self) -> float | None:
+        '''If the page's host, or every site in the group, is failing, returns how long to back off before checking again. When both are
+        failing, the longer delay wins. Returns None if the group should be checked at its normal interval.'''
+        delays = []
+        if self.host_breaker.is_failing:
+            delays.append(self.host_breaker.time_until_retry())
+        if self.site_managers and all(site_manager.breaker.is_failing for site_manager in self.site_managers):
+            delays.append(min(site_manager.breaker.time_until_retry() for site_manager in self.site_managers))
+        return max(delays, default=None)
+
+    @property
+    def breaker_open(self) -> bool:
+        '''Whether the host's breaker, or every site's breaker, is open, so the group should only be probed.'''
+        return self.host_breaker.is_open or (len(self.site_managers) > 0 and all(site_manager.breaker.is_open for site_manager in self.site_managers))
+
+    def run(self, get_driver: DriverSource | None) -> bool:
+        '''Loads the page once and runs every site manager's test on it. Disabled site managers are removed from the group. Returns False once every site manager is disabled.'''
+        with self.lock:
+            self.site_managers = [site_manager for site_manager in self.site_managers if not site_manager.disabled]
+            site_managers = list(self.site_managers) # sites added during the check wait for the next one
+        if len(site_managers) == 0:
+            return False
+        for site_manager in site_managers:
+            site_manager.get_driver = get_driver
+
+        try:
+            page = site_managers[0].load_page()
+        except Exception as error: # every site in the group fails the same way
+            if is_host_error(error):
+                self.host_breaker.record_failure()
+            for site_manager in site_managers:
+                site_manager.page = None
+                site_manager.failure_from_error(error)
+        else:
+            self.host_breaker.record_success()
+            for site_manager in site_managers:
+                site_manager.run(page)
+
+        for site_manager in site_managers:
+            site_manager.get_driver = None
+        with self.lock:
+            self.site_managers = [site_manager for site_manager in self.site_managers if not site_manager.disabled]
+            return len(self.site_managers) > 0
@@ -1,11 +1,19 @@
-from selenium import webdriver
 from selenium.common import exceptions as selenium_exceptions
-from selenium.webdriver.common.by import By
 from emailmanager import EmailManager
-import sys
+from httpfetcher import HTTPFetcher
+from pages import Page, BrowserPage, HTTPPage, AutoPage, DriverSource
+from testtypes import TestType, create_test
+from metrics import Metrics
+from diagnostics import DiagnosticsWriter
+from circuitbreaker import CircuitBreaker, RetryPolicy
+import requests
 from pathlib import Path
 import json
-import datetime
+import hashlib
+import time
+
+class SiteConfigError(Exception):
+    '''Raised when a site config file is invalid. The message says what is wrong with it.'''
 
 class SiteManager:
 
@@ -16,84 +24,123 @@ class SiteManager:
     compare_value: any
     send_to: list[dict[str, str]]
     send_url: str
+    engine: str
+    interval: (int | float) | None
+    jitter: (int | float)
 
     disabled = False
     test_met = False
+    error_notified = False # whether an error email has been sent for the current run of failures
+    last_result: str | None = None # 'met', 'not_met' or 'error'
+    last_change: float | None = None # when test_met last changed, as a unix timestamp
+    page: Page | None = None # the page the last test ran against
 
-    def __init__(self, driver: webdriver.Firefox, config_path: Path, email_manager: EmailManager):
-        self.driver = driver
+    def __init__(self, get_driver: DriverSource | None, config_path: Path, email_manager: EmailManager, http_fetcher: HTTPFetcher, metrics: Metrics, diagnostics_writer: DiagnosticsWriter, retry_policy: RetryPolicy):
+        self.get_driver = get_driver # set by the site group for each check, None when no browser can be used
+        self.key = config_path.name # identifies the site in the state store
         self.email_manager = email_manager
+        self.http_fetcher = http_fetcher
+        self.metrics = metrics
+        self.diagnostics_writer = diagnostics_writer
+        self.retry_policy = retry_policy
+        self.breaker = CircuitBreaker(retry_policy)
 
         # load config file
         with config_path.open() as config_file:
             try:
                 config: dict = json.load(config_file)
-                self.load_config(config, config_path.name)
-            except json.decoder.JSONDecodeError as error:
-                print(f"ERROR: site configuration '{config_path.name}' is not valid JSON. See message below for decoder response.")
-                print("Message:", error)
-                sys.exit()
+            except (json.decoder.JSONDecodeError, UnicodeDecodeError) as error:
+                raise SiteConfigError(f"ERROR: site configuration '{config_path.name}' is not valid JSON. Decoder message: {error}.")
+        self.load_config(config, config_path.name)
         
         # set test
         self.set_test()
 
-    def run(self) -> bool:
-        '''Runs one test. Returns False if the site_manager is disabled, otherwise returns True.'''
+    def run(self, page: Page | None = None) -> bool:
+        '''Runs one test. If a page is given, the test uses it instead of loading the page again. Returns False if the site_manager is disabled, otherwise returns True.'''
         if self.disabled:
             return False
         else:
-            self.test()
+            self.test(page)
             return True if not self.disabled else False
 
+    def load_page(self) -> Page:
+        '''Loads the page with the configured engine.'''
+        with self.metrics.time(self.name, 'page_load'):
+            match self.engine:
+                case 'http':
+                    return HTTPPage(self.http_fetcher, self.url)
+                case 'auto':
+                    return AutoPage(self.http_fetcher, self.get_driver, self.url)
+                case _:
+                    return BrowserPage(self.get_driver(), self.url)
+
     def load_config(self, config: dict, file_name: str):
+        '''Validates the site config and loads it. Raises a SiteConfigError if it is invalid.'''
+        if type(config) != dict:
+            raise SiteConfigError(f"ERROR: site configuarion '{file_name}' is invalid. The file must contain a JSON object. See documentation for more details.")
         self._validate_config_parameter(config, 'name', file_name)
         self._validate_config_parameter(config, 'url', file_name)
         self._validate_config_parameter(config, 'elementXPath', file_name)
         self._validate_config_parameter(config, 'testType', file_name)
         self._validate_config_parameter(config, 'compareValue', file_name)
         self._validate_config_parameter(config, 'sendTo', file_name)
-        
+        for parameter in ('name', 'url', 'elementXPath', 'testType', 'sendURL'):
+            if parameter in config and type(config[parameter]) != str:
+                raise SiteConfigError(f"ERROR: site configuarion '{file_name}' is invalid. Parameter '{parameter}' must be a string. See documentation for more details.")
+
         if type(config['sendTo']) != list:
-            print(f"ERROR: site configuarion '{file_name}' is invalid. Parameter 'sendTo' must be a list. See documentation for more details.")
-            sys.exit()
+            raise SiteConfigError(f"ERROR: site configuarion '{file_name}' is invalid. Parameter 'sendTo' must be a list. See documentation for more details.")
         if len(config['sendTo']) == 0:
             print(f"WARNING: site configuration '{file_name} has no sendTo values. No notification will be sent!")
         for index, obj in enumerate(config['sendTo']):
-            if not obj.get("emailAddress"):
-                print(f"ERROR: site configuarion '{file_name}' is invalid. 'sendTo' block {index + 1} is missing required parameter 'emailAddress'. See documentation for more details.")
-                sys.exit()
+            if type(obj) != dict or not obj.get("emailAddress"):
+                raise SiteConfigError(f"ERROR: site configuarion '{file_name}' is invalid. 'sendTo' block {index + 1} is missing required parameter 'emailAddress'. See documentation for more details.")
+            if type(obj['emailAddress']) != str or type(obj.get('displayName', '')) != str:
+                raise SiteConfigError(f"ERROR: site configuarion '{file_name}' is invalid. 'emailAddress' and 'displayName' in 'sendTo' block {index + 1} must be strings. See documentation for more details.")
+        if config.get('engine', 'browser') not in ('browser', 'http', 'auto'):
+            raise SiteConfigError(f"ERROR: site configuarion '{file_name}' is invalid. Parameter 'engine' must be one of 'browser', 'http' or 'auto'. See documentation for more details.")
+        for parameter in ('interval', 'jitter'):
+            if parameter in config and (type(config[parameter]) not in (int, float) or config[parameter] < 0):
+                raise SiteConfigError(f"ERROR: site configuarion '{file_name}' is invalid. Parameter '{parameter}' must be a number of seconds that is not negative. See documentation for more details.")
         
         self.name = config['name']
         self.url = config['url']
         self.element_xpath = config['elementXPath']
         self.test_type = config['testType']
         self.compare_value = config['compareValue']
-        self.send_to = config['sendTo']
+        self.send_to = [{'emailAddress': obj['emailAddress'], 'displayName': obj.get('displayName') or obj['emailAddress']} for obj in config['sendTo']] # displayName is optional
         self.send_url = config['sendURL'] if config.get('sendURL') else config['url']
-    
+        self.engine = config.get('engine', 'browser')
+        self.interval = config.get('interval') # if not set, the waitTime from config.json is used
+        self.jitter = config.get('jitter', 0)
+        # a hash of the page and test, saved with the site's state so that state is only restored to a site that still runs the same test
+        self.fingerprint = hashlib.sha256(json.dumps([self.url, self.element_xpath, self.test_type, self.compare_value]).encode()).hexdigest()
+
     def _validate_config_parameter(self, config: dict, parameter: str, file_name: str):
         if not config.get(parameter):
-            print(f"ERROR: site configuarion '{file_name}' is missing required parameter '{parameter}'. See documentation for more details.")
-            sys.exit()
+            raise SiteConfigError(f"ERROR: site configuarion '{file_name}' is missing required parameter '{parameter}'. See documentation for more details.")
     
     def set_test(self):
-        '''Sets self.test to the correct function depending on test type.'''
-        match self.test_type:
-            case 'element_does_not_contain_text':
-                # checks the element to see if the element's text contains the compare value. If not, it triggers the success response.
-                self.test = self.element_does_not_contain_text_test
-            case _:
-                self.failure_response(f"[ERROR] Site '{self.name}' is configured with a test type that is not valid. Please check the documentation for a list of valid test types.")
-                self.stop()
-
-    def element_does_not_contain_text_test(self):
-        '''Tests if the element's text contains the compare value. If not, it triggers the success response.'''
+        '''Compiles the configured test type once, and sets self.test to run it. Raises a SiteConfigError if the test type or compare value is invalid.'''
+        try:
+            self.test_runner: TestType = create_test(self.test_type, self.compare_value)
+        except ValueError as error:
+            raise SiteConfigError(f"ERROR: site configuarion '{self.key}' is invalid. {error} See documentation for more details.")
+        self.test = self.element_test
+
+    def element_test(self, page: Page | None = None):
+        '''Runs the test type against the element. If its condition is met, it triggers the success response.'''
 
         try:
-            self.driver.get(self.url) # gets the page
-            element = self.driver.find_element(By.XPATH, self.element_xpath) # tries to find the given element
-            text: str = element.get_attribute('innerHTML') # gets the text of the element
-            if self.compare_value not in text: # if the compare value is contained within the text of the element, then it activates the success response
+            self.page = page
+            if self.page is None:
+                self.page = self.load_page()
+            with self.metrics.time(self.name, 'element_check'):
+                result = self.test_runner.check(self.page, self.element_xpath)
+            if result.met: # if the test's condition is met, then it activates the success response
+                if not self.test_met:
+                    print(f"Site '{self.name}' {self.test_runner.met_message}. Element text: {result.excerpt!r}")
                 self.success_response()
             else: # otherwise it activates the normal response
                 self.normal_response()
@@ -105,81 +152,114 @@ class SiteManager:
         message_start = f"[ERROR] Test failed for '{self.name}'. "
         message_end = ''
 
-        send_email = True
-
         match type(exception):
             case selenium_exceptions.NoSuchElementException:
                 diagnostic_name = self.save_diagnostic_data()
-                message_end = f"The element could not be found on the page. This could be because the time the page takes to load exceeds the page wait time, or that your XPath is invalid. Check your configuration. Diagnostic data for this error has been saved to diagnostics/{diagnostic_name}"
+                message_end = f"The element could not be found on the page. This could be because the time the page takes to load exceeds the page wait time, or that your XPath is invalid. Check your configuration. Diagnostic data for this error has been saved to {diagnostic_name}"
             case selenium_exceptions.WebDriverException:
                 diagnostic_name = self.save_diagnostic_data()
-                message_end = f"A WebDriverException occurred. This is most likely because it failed to get the page. Check your network settings! Diagnostic data has been saved to diagnostics/{diagnostic_name}. The error message is printed below:\n{exception.msg}"
-                send_email = False
+                message_end = f"A WebDriverException occurred. This is most likely because it failed to get the page. Check your network settings! Diagnostic data has been saved to {diagnostic_name}. The error message is printed below:\n{exception.msg}"
+            case error_type if issubclass(error_type, requests.RequestException):
+                diagnostic_name = self.save_diagnostic_data()
+                message_end = f"A {error_type.__name__} occurred while fetching the page over HTTP. Check your network settings! Diagnostic data has been saved to {diagnostic_name}. The error message is printed below:\n{exception}"
             case _ as error:
                 diagnostic_name = self.save_diagnostic_data()
-                message_end = f"A {type(exception)} occurred. Diagnostics saved to diagnostics/{diagnostic_name}. Error output message: {str(exception)}"
+                message_end = f"A {type(exception)} occurred. Diagnostics saved to {diagnostic_name}. Error output message: {str(exception)}"
         
-        self.failure_response(message_start + message_end, send_email)
-    
-    def failure_response(self, message: str, send_email: bool = True):
-        '''This function defines how the program should respond to an error.''' 
-        subject = f'Error Notification for "{self.name}"'
-        email_message = f'''
-        This is an error notification for the site "{self.name}". An error was encountered while testing, and testing for this site has been stopped.
+        self.error_response(message_start + message_end)
+
+    def error_response(self, message: str):
+        '''This function defines how the program should respond to an error during a test. Testing continues with backoff, and an error email is only sent once the site has been failing for longer than errorEmailAfter.'''
+        print(message)
+        self.breaker.record_failure()
+        self.last_result = 'error'
+        if self.breaker.is_open and not self.error_notified and self.breaker.open_duration() >= self.retry_policy.error_email_after:
+            subject = f'Error Notification for "{self.name}"'
+            email_message = f'''
+        This is an error notification for the site "{self.name}". It has failed the last {self.breaker.consecutive_failures} tests and has been failing for over {self.breaker.open_duration() / 60:.0f} minutes. Testing will continue less often, and you will be notified when it recovers.
 
         Error Message: {message}
         '''
-        if send_email:
             for recipient in self.send_to:
                 self.email_manager.send_email(recipient['emailAddress'], recipient['displayName'], subject, email_message)
-        print(message)
-        self.stop()
+            self.error_notified = True
+
+    def recovered_response(self):
+        '''This function triggers when a test finishes without an error. If the site was failing, it is marked as recovered.'''
+        if self.breaker.is_failing:
+            print(f"Site '{self.name}' has recovered after {self.breaker.consecutive_failures} failed tests.")
+        if self.error_notified:
+            subject = f'Recovery Notification for "{self.name}"'
+            message = f"{self.name} is working again and testing has returned to normal. View the link: {self.send_url}"
+            for recipient in self.send_to:
+                self.email_manager.send_email(recipient['emailAddress'], recipient['displayName'], subject, message)
+            self.error_notified = False
+        self.breaker.record_success()
     
     def success_response(self):
         '''This function triggers when the test criteria are met. It should stop the webdriver and send an email.'''
+        self.recovered_response()
         if self.test_met: # if the test has already been met, do not send another email
             print(f"Site '{self.name}' triggered success response again. Testing will continue.")
         else: # if this is the first time the test has been met, send emails
             subject = f'Stock Notification for "{self.name}"'
             message = f"{self.name} was triggered! View the link: {self.send_url}"
-            for recipient in self.send_to:
-                self.email_manager.send_email(recipient['emailAddress'], recipient['displayName'], subject, message)
-            print(f"Site '{self.name}' triggered success response! Emails have been sent!")
+            for recipient in self.send_to: # urgent, so restock alerts only wait the short alertDelay instead of the whole digest window
+                self.email_manager.send_email(recipient['emailAddress'], recipient['displayName'], subject, message, urgent=True)
+            print(f"Site '{self.name}' triggered success response! Emails have been queued!")
+        if not self.test_met:
+            self.last_change = time.time()
         self.test_met = True
+        self.last_result = 'met'
     
     def normal_response(self):
         '''This function triggers when the test criteria is not met, but no errors occur, and the program can continue running.'''
+        self.recovered_response()
         if self.test_met: # if product is no longer available, send emails
             subject = f'Stock Notification for "{self.name}"'
             message = f"{self.name} has returned to normal. View the link: {self.send_url}"
             for recipient in self.send_to:
                 self.email_manager.send_email(recipient['emailAddress'], recipient['displayName'], subject, message)
-            print(f"Site '{self.name}' has gone from meeting tests to failing tests. Normality messages have been sent. Testing will continue.")
+            print(f"Site '{self.name}' has gone from meeting tests to failing tests. Normality messages have been queued. Testing will continue.")
         else: # if product is still not available, send emails
             print(f"Site '{self.name}' tested negative and will continue running.")
+        if self.test_met:
+            self.last_change = time.time()
         self.test_met = False
+        self.last_result = 'not_met'
     
     def save_diagnostic_data(self):
-        '''Creates a new folder in the diagnostic folder with a screenshot of the browser's current state, and a saved version of the page source code.'''
-        diagnostics_folder = Path('./diagnostics')
-        save_folder_name = self.name + datetime.datetime.now().strftime('%m%d%Y-%H%M%S')
-        full_folder = diagnostics_folder / save_folder_name
-        if not full_folder.exists():
-            full_folder.mkdir()
-        
-        screenshot_path = full_folder / 'screenshot.png'
-        html_path = full_folder / 'page_source.html'
-
+        '''Grabs a screenshot of the browser's current state and the page source, and hands them to the diagnostics writer to be saved in the background. Returns the path they will be saved to.'''
         try:
-            self.driver.save_screenshot(str(screenshot_path.absolute()))
-            page_source = self.driver.page_source
-            html_path.write_text(page_source)
+            with self.metrics.time(self.name, 'diagnostics'):
+                if self.page is not None:
+                    screenshot, page_source = self.page.snapshot()
+                elif self.get_driver is not None and self.engine == 'browser': # the page failed to load, so save whatever state the browser was left in
+                    driver = self.get_driver()
+                    screenshot, page_source = driver.get_screenshot_as_png(), driver.page_source.encode()
+                else:
+                    screenshot, page_source = None, b''
         except Exception as error:
-            print(f"[DIAGNOSTICS ERROR] Diagnostic data save failed for site '{self.name}'. Error message below:")
+            print(f"[DIAGNOSTICS ERROR] Diagnostic data capture failed for site '{self.name}'. Error message below:")
             print(error)
-        else:
-            print(f"[DIAGNOSTICS] Diagnostic data for site '{self.name}' saved to diagnostics/{save_folder_name}")
-        return save_folder_name
+            screenshot, page_source = None, b''
+        return self.diagnostics_writer.submit(self.name, self.url, screenshot, page_source)
+
+    def get_state(self, next_due: float | None) -> dict:
+        '''Returns the state that should be saved to the state store.'''
+        return {'test_met': self.test_met, 'last_result': self.last_result, 'last_change': self.last_change, 'failure_count': self.breaker.consecutive_failures, 'next_due': next_due, 'fingerprint': self.fingerprint}
+
+    def same_test_as(self, other: 'SiteManager') -> bool:
+        '''Whether another site manager runs the same test on the same page, so that its state still applies to this one.'''
+        return self.fingerprint == other.fingerprint
+
+    def restore_state(self, state: dict):
+        '''Restores state saved by a previous run, so that an item that was already in stock doesn't trigger another email.'''
+        self.test_met = bool(state['test_met'])
+        self.last_result = state['last_result']
+        self.last_change = state['last_change']
+        for _ in range(state['failure_count']):
+            self.breaker.record_failure()
 
     def stop(self):
         '''Sets state to disabled. Should also perform any necessary cleanup.'''
@@ -0,0 +1,32 @@
+from pathlib import Path
+from typing import Callable
+
+class SiteWatcher:
+    '''Watches the sites directory for config files that are added, changed or deleted. Files are compared by modification time
+    and size, so nothing is read until it changes and only the standard library is needed.'''
+
+    def __init__(self, sites_dir: Path, site_filter: Callable[[Path], bool] | None = None):
+        self.sites_dir = sites_dir
+        self.site_filter = site_filter
+        self.files: dict[Path, tuple[int, int]] = {} # config path -> (modification time in nanoseconds, size) when last seen
+
+    def scan(self) -> dict[Path, tuple[int, int]]:
+        files = {}
+        for site in self.sites_dir.glob('*.json'):
+            if site.name[0] == '.' or (self.site_filter is not None and not self.site_filter(site)): # skip files with a .name, and files filtered out
+                continue
+            try:
+                stat = site.stat()
+            except FileNotFoundError: # deleted while scanning, so the next poll will see it as removed
+                continue
+            files[site] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def poll(self) -> tuple[list[Path], list[Path], list[Path]]:
+        '''Returns the config files that were added, changed and removed since the last poll. The first poll returns every file as added.'''
+        files = self.scan()
+        added = sorted(site for site in files if site not in self.files)
+        changed = sorted(site for site in files if site in self.files and files[site] != self.files[site])
+        removed = sorted(site for site in self.files if site not in files)
+        self.files = files
+        return added, changed, removed
@@ -0,0 +1,86 @@
+from pathlib import Path
+import sqlite3
+import threading
+
+class StateStore:
+    '''Saves each site's state to a SQLite database, so that a restart can carry on where the last run stopped.
+
+    Updates are collected in memory and written in batches by a background thread, so saving state never blocks a check.
+    The database uses WAL mode, so worker processes can share it.'''
+
+    columns = ('test_met', 'last_result', 'last_change', 'failure_count', 'next_due', 'fingerprint')
+
+    def __init__(self, path: Path, flush_interval: (int | float) = 1):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending: dict[str, dict] = {} # site key -> latest state, replaced by each update until it is written
+        self.stopped = threading.Event()
+        connection = self.connect()
+        try:
+            with connection: # commits, but doesn't close the connection
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('''CREATE TABLE IF NOT EXISTS sites (
+                    key TEXT PRIMARY KEY,
+                    test_met INTEGER NOT NULL,
+                    last_result TEXT,
+                    last_change REAL,
+                    failure_count INTEGER NOT NULL,
+                    next_due REAL,
+                    fingerprint TEXT
+                )''')
+                if 'fingerprint' not in [row[1] for row in connection.execute('PRAGMA table_info(sites)')]: # databases saved before fingerprints were added
+                    connection.execute('ALTER TABLE sites ADD COLUMN fingerprint TEXT')
+        finally:
+            connection.close()
+        self.thread = threading.Thread(target=self.write_loop, name='StateStore', daemon=True)
+        self.thread.start()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30) # waits for other workers' writes instead of failing
+        connection.execute('PRAGMA synchronous=NORMAL') # safe with WAL, and much faster than FULL
+        return connection
+
+    def load(self) -> dict[str, dict]:
+        '''Returns the saved state of every site, by site key.'''
+        connection = self.connect()
+        try:
+            rows = connection.execute(f'SELECT key, {", ".join(self.columns)} FROM sites').fetchall()
+        finally:
+            connection.close()
+        return {row[0]: dict(zip(self.columns, row[1:])) for row in rows}
+
+    def update(self, key: str, state: dict):
+        '''Queues a site's state to be saved. Returns straight away.'''
+        with self.lock:
+            self.pending[key] = state
+
+    def write_loop(self):
+        connection = self.connect()
+        try:
+            while not self.stopped.wait(self.flush_interval):
+                self.flush(connection)
+            self.flush(connection)
+        finally:
+            connection.close()
+
+    def flush(self, connection: sqlite3.Connection):
+        '''Writes every pending update in one transaction.'''
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+        if not pending:
+            return
+        rows = [(key, int(state['test_met']), state['last_result'], state['last_change'], state['failure_count'], state['next_due'], state['fingerprint']) for key, state in pending.items()]
+        try:
+            with connection:
+                connection.executemany(f'INSERT OR REPLACE INTO sites (key, {", ".join(self.columns)}) VALUES (?, {", ".join("?" for _ in self.columns)})', rows)
+        except sqlite3.Error as error:
+            print(f'[STATE ERROR] Failed to save site state. Error message: {error}')
+            with self.lock: # try again next time, without overwriting anything newer
+                self.pending = pending | self.pending
+
+    def stop(self, timeout: (int | float) = 30):
+        '''Writes any pending updates, then stops the writer thread.'''
+        self.stopped.set()
+        self.thread.join(timeout)
@@ -0,0 +1,90 @@
+import socket
+import tempfile
+import threading
+import unittest
+from benchmark import SMTPSink
+from emailmanager import EmailManager
+from metrics import Metrics
+from pathlib import Path
+
+SENDER_OPTIONS = {'displayName': 'Stock Notifier', 'emailAddress': 'notifier@example.com'}
+
+class RestartableSink(SMTPSink):
+    '''An SMTPSink that drops its open connections when it stops, like a server that restarts.'''
+
+    def __init__(self, port: int = 0):
+        super().__init__(port)
+        self.connections: list[socket.socket] = []
+
+    def process_request(self, request, client_address):
+        self.connections.append(request)
+        super().process_request(request, client_address)
+
+def start_sink(port: int = 0) -> RestartableSink:
+    sink = RestartableSink(port)
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+    return sink
+
+def stop_sink(sink: RestartableSink):
+    sink.shutdown()
+    sink.server_close()
+    for connection in sink.connections:
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError: # already closed by the client
+            pass
+
+class EmailManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.metrics = Metrics(Path(self.directory.name), 0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_email_manager(self, port: int) -> EmailManager:
+        email_manager = EmailManager({'url': '127.0.0.1', 'port': port, 'login': 'user', 'password': 'password', 'tls': False}, SENDER_OPTIONS, self.metrics)
+        email_manager.timeout = 5
+        email_manager.retry_delay = 0.05
+        email_manager.max_retry_delay = 0.2
+        return email_manager
+
+    def test_sends_batch(self):
+        sink = start_sink()
+        email_manager = self.make_email_manager(sink.server_address[1])
+        futures = [email_manager.send_email('to@example.com', 'To', f'Email {index}', 'Body') for index in range(5)]
+        for future in futures:
+            future.result(timeout=10)
+        email_manager.stop()
+        stop_sink(sink)
+        self.assertEqual([subject for _, subject in sink.messages], [f'Email {index}' for index in range(5)])
+
+    def test_reconnects_and_sends_waiting_emails(self):
+        sink = start_sink()
+        port = sink.server_address[1]
+        email_manager = self.make_email_manager(port)
+        email_manager.send_email('to@example.com', 'To', 'Before', 'Body').result(timeout=10)
+        stop_sink(sink) # the server goes away with the connection still open
+
+        futures = [email_manager.send_email('to@example.com', 'To', f'While down {index}', 'Body') for index in range(3)]
+        self.assertFalse(any(future.done() for future in futures))
+        sink = start_sink(port)
+        for future in futures:
+            future.result(timeout=10)
+        email_manager.stop()
+        stop_sink(sink)
+        self.assertEqual([subject for _, subject in sink.messages], [f'While down {index}' for index in range(3)])
+
+    def test_gives_up_once_server_is_down_for_too_long(self):
+        sink = start_sink()
+        port = sink.server_address[1]
+        stop_sink(sink) # nothing listens on the port
+        email_manager = self.make_email_manager(port)
+        email_manager.give_up_after = 0.3
+        future = email_manager.send_email('to@example.com', 'To', 'Never sent', 'Body')
+        self.assertIsInstance(future.exception(timeout=10), OSError)
+        email_manager.stop()
+
+if __name__ == '__main__':
+    unittest.main()
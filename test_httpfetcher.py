@@ -0,0 +1,108 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from httpfetcher import HTTPFetcher
+from pages import AutoPage, HTTPPage, MARK_PREVIOUS_PAGE_SCRIPT
+from selenium.common import exceptions as selenium_exceptions
+
+PAGES = {
+    '/product': '<html><body><div id="stock">A &amp; B&nbsp;C &lt;x&gt; <b title="x&amp;y">in &amp; &nbsp;</b> tail &amp;</div>'
+                '<ul><li>One</li><li>Two</li><li>Three</li></ul><script id="data">if (a < b && c) {}</script></body></html>',
+    '/empty': '',
+}
+
+class PageHandler(BaseHTTPRequestHandler):
+    '''Serves the pages in PAGES, and a 404 for anything else.'''
+
+    def do_GET(self):
+        if self.path not in PAGES:
+            self.send_error(404)
+            return
+        body = PAGES[self.path].encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeDriver:
+    '''Stands in for Firefox. Every element is found, and every check matches.'''
+
+    def __init__(self):
+        self.current_url = 'about:blank'
+        self.visited: list[str] = []
+
+    def get(self, url: str):
+        self.current_url = url
+        self.visited.append(url)
+
+    def execute_script(self, script: str, *args):
+        if script == MARK_PREVIOUS_PAGE_SCRIPT:
+            return None
+        return {'found': True, 'matched': True, 'excerpt': 'In Stock', 'html': None if args[2] is not None else 'In Stock'}
+
+class HTTPFetcherTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.http_fetcher = HTTPFetcher(2)
+        self.driver = FakeDriver()
+
+    def tearDown(self):
+        self.http_fetcher.close()
+
+    def get_driver(self) -> FakeDriver:
+        return self.driver
+
+    def test_inner_html_matches_browser(self):
+        page = HTTPPage(self.http_fetcher, self.base_url + '/product')
+        self.assertEqual(page.element_html('//div[@id="stock"]'), 'A &amp; B&nbsp;C &lt;x&gt; <b title="x&amp;y">in &amp; &nbsp;</b> tail &amp;')
+        self.assertEqual(page.element_html('//script[@id="data"]'), 'if (a < b && c) {}') # raw text isn't escaped
+
+    def test_text_and_count_xpaths(self):
+        page = HTTPPage(self.http_fetcher, self.base_url + '/product')
+        self.assertEqual(page.element_html('//li[2]/text()'), 'Two')
+        self.assertEqual(page.element_html('//b/@title'), 'x&y')
+        self.assertEqual(page.element_html('count(//li)'), '3.0')
+        self.assertTrue(page.check_contains('//div[@id="stock"]', ['&nbsp;C']).matched)
+
+    def test_missing_element(self):
+        page = HTTPPage(self.http_fetcher, self.base_url + '/product')
+        with self.assertRaises(selenium_exceptions.NoSuchElementException):
+            page.element_html('//div[@id="missing"]')
+
+    def test_auto_page_uses_http_when_element_is_there(self):
+        page = AutoPage(self.http_fetcher, self.get_driver, self.base_url + '/product')
+        self.assertFalse(page.check_contains('//div[@id="stock"]', ['In Stock']).matched)
+        self.assertEqual(self.driver.visited, [])
+
+    def test_auto_page_falls_back_for_missing_element(self):
+        url = self.base_url + '/product'
+        page = AutoPage(self.http_fetcher, self.get_driver, url)
+        self.assertTrue(page.check_contains('//div[@id="added-by-javascript"]', ['In Stock']).matched)
+        self.assertEqual(self.driver.visited, [url])
+
+    def test_auto_page_falls_back_when_fetch_fails(self):
+        for path in ('/empty', '/missing'): # an empty body can't be parsed, and a 404 raises
+            url = self.base_url + path
+            page = AutoPage(self.http_fetcher, self.get_driver, url)
+            self.assertIsNone(page.http_page)
+            self.assertEqual(page.element_html('//div'), 'In Stock')
+            self.assertEqual(self.driver.visited[-1], url)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import random
+import unittest
+from matching import PhraseMatcher, element_text, parse_price
+
+class PhraseMatcherTest(unittest.TestCase):
+
+    def test_finds_first_phrase(self):
+        matcher = PhraseMatcher(['he', 'she', 'his', 'hers'])
+        self.assertEqual(matcher.search('ushers'), 1) # 'she' ends first
+        self.assertEqual(matcher.search('ahis'), 1)
+        self.assertEqual(matcher.search('hers'), 0)
+
+    def test_no_match(self):
+        matcher = PhraseMatcher(['Out of Stock', 'Ausverkauft'])
+        self.assertEqual(matcher.search('In Stock'), -1)
+        self.assertEqual(matcher.search(''), -1)
+        self.assertEqual(matcher.search('Out of Stoc'), -1)
+
+    def test_phrase_inside_another(self):
+        matcher = PhraseMatcher(['abcd', 'bc'])
+        self.assertEqual(matcher.search('xabcx'), 2)
+
+    def test_matches_brute_force(self):
+        generator = random.Random(0)
+        for _ in range(2000):
+            phrases = [''.join(generator.choice('ab') for _ in range(generator.randint(1, 4))) for _ in range(generator.randint(1, 5))]
+            text = ''.join(generator.choice('abc') for _ in range(generator.randint(0, 12)))
+            matches = [(start + len(phrase), start) for phrase in phrases for start in range(len(text)) if text.startswith(phrase, start)]
+            index = PhraseMatcher(phrases).search(text)
+            if matches:
+                first_end = min(end for end, _ in matches)
+                self.assertIn(text[index:first_end], phrases, (phrases, text))
+            else:
+                self.assertEqual(index, -1, (phrases, text))
+
+class ParsePriceTest(unittest.TestCase):
+
+    def test_formats(self):
+        self.assertEqual(parse_price('$1,299.99'), 1299.99)
+        self.assertEqual(parse_price('1.299,99 €'), 1299.99)
+        self.assertEqual(parse_price('1\u00a0299,99 €'), 1299.99)
+        self.assertEqual(parse_price('£19.9'), 19.9)
+        self.assertEqual(parse_price('1,299'), 1299)
+        self.assertEqual(parse_price('Price: 45'), 45)
+
+    def test_first_price(self):
+        self.assertEqual(parse_price('19.99 (was 29.99)'), 19.99)
+
+    def test_no_price(self):
+        self.assertIsNone(parse_price('Out of Stock'))
+
+    def test_element_text(self):
+        text = element_text('<span>£</span>&nbsp;<b>19.99</b>')
+        self.assertEqual(parse_price(text), 19.99)
+        self.assertNotIn('<', text)
+
+if __name__ == '__main__':
+    unittest.main()
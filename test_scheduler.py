@@ -0,0 +1,94 @@
+from circuitbreaker import CircuitBreaker, RetryPolicy
+from scheduler import Scheduler
+from sitegroup import SiteGroup, is_host_error
+from types import SimpleNamespace
+import requests
+import unittest
+
+def http_error(status_code: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(f'{status_code} error', response=response)
+
+class FakeSiteManager:
+    '''Just enough of a SiteManager for a SiteGroup: loading the page raises the given error, which counts against the site's breaker.'''
+
+    disabled = False
+    interval = None
+    jitter = 0
+
+    def __init__(self, retry_policy: RetryPolicy, error: Exception | None = None, interval: (int | float) | None = None):
+        self.name = 'fake'
+        self.breaker = CircuitBreaker(retry_policy)
+        self.error = error
+        self.interval = interval
+
+    def load_page(self):
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace()
+
+    def failure_from_error(self, error: Exception):
+        self.breaker.record_failure()
+
+    def run(self, page) -> bool:
+        self.breaker.record_success()
+        return True
+
+class BreakerSchedulingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.retry_policy = RetryPolicy({'baseDelay': 1, 'maxDelay': 900, 'failureThreshold': 3})
+        self.host_breaker = CircuitBreaker(self.retry_policy)
+        self.scheduler = Scheduler(10)
+
+    def make_group(self, site_manager: FakeSiteManager) -> SiteGroup:
+        site_group = SiteGroup('http://127.0.0.1/page', 'http', self.host_breaker)
+        site_group.add(site_manager)
+        return site_group
+
+    def test_broken_page_backs_off_while_host_is_healthy(self):
+        broken = self.make_group(FakeSiteManager(self.retry_policy, http_error(404)))
+        healthy = self.make_group(FakeSiteManager(self.retry_policy))
+        for _ in range(6):
+            broken.run(None)
+            healthy.run(None) # a success on the same host must not reset the broken page's backoff
+        self.assertFalse(self.host_breaker.is_failing)
+        self.assertGreater(broken.retry_delay(), 15) # at least half of baseDelay * 2 ** 5
+
+    def test_larger_delay_wins(self):
+        site_manager = FakeSiteManager(self.retry_policy)
+        site_group = self.make_group(site_manager)
+        for _ in range(5):
+            site_manager.breaker.record_failure()
+        self.host_breaker.record_failure()
+        self.assertAlmostEqual(site_group.retry_delay(), site_manager.breaker.time_until_retry(), delta=0.01)
+
+    def test_open_breaker_never_checks_faster_than_interval(self):
+        site_manager = FakeSiteManager(self.retry_policy, http_error(404), interval=3600)
+        site_group = self.make_group(site_manager)
+        for _ in range(4):
+            site_group.run(None)
+        self.assertTrue(site_group.breaker_open)
+        self.assertGreaterEqual(self.scheduler.schedule_next(site_group), 3600)
+
+    def test_failing_breaker_retries_before_interval(self):
+        site_group = self.make_group(FakeSiteManager(self.retry_policy, http_error(404), interval=3600))
+        site_group.run(None)
+        self.assertFalse(site_group.breaker_open)
+        self.assertLessEqual(self.scheduler.schedule_next(site_group), 1)
+
+    def test_host_errors(self):
+        self.assertFalse(is_host_error(http_error(404)))
+        self.assertTrue(is_host_error(http_error(503)))
+        self.assertTrue(is_host_error(requests.ConnectionError()))
+        self.assertTrue(is_host_error(requests.ReadTimeout()))
+        self.assertFalse(is_host_error(ValueError()))
+
+    def test_server_errors_count_against_host(self):
+        site_group = self.make_group(FakeSiteManager(self.retry_policy, http_error(502)))
+        site_group.run(None)
+        self.assertTrue(self.host_breaker.is_failing)
+
+if __name__ == '__main__':
+    unittest.main()
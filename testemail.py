@@ -6,7 +6,9 @@ app = App()
 recipient_email = input('Email address to send to: ')
 recipient_name = input('Recipient display name: ')
 
-email_result = app.email_manager.send_email(recipient_email, recipient_name, "Test Email from Stock Notifier", "This is a test email from Stock Notifier. If you've recieved this, it means that your SMTP setup is working!")
+email_future = app.email_manager.send_email(recipient_email, recipient_name, "Test Email from Stock Notifier", "This is a test email from Stock Notifier. If you've recieved this, it means that your SMTP setup is working!", urgent=True)
+email_result = email_future.result() # emails are sent in the background, so wait for this one to go out
+app.email_manager.stop()
 
 if email_result == {}:
     print('Email sent with no issues.')
@@ -0,0 +1,105 @@
+from pages import Page, EXCERPT_LENGTH, html_excerpt
+from matching import PhraseMatcher, element_text, parse_price
+from abc import ABC, abstractmethod
+from typing import Callable, NamedTuple
+import re
+
+class TestResult(NamedTuple):
+    '''The result of running a test type against an element.'''
+    met: bool # whether the test's condition was met, which triggers the success response
+    excerpt: str # a short piece of the element's text, to show what the test saw
+
+# test type name -> the class that runs it, filled in by register_test_type
+TEST_TYPES: dict[str, type['TestType']] = {}
+
+def register_test_type(name: str) -> Callable[[type['TestType']], type['TestType']]:
+    '''Class decorator that makes a test type available to site configs under the given testType name.'''
+    def register(test_class: type['TestType']) -> type['TestType']:
+        TEST_TYPES[name] = test_class
+        return test_class
+    return register
+
+def create_test(test_type: str, compare_value) -> 'TestType':
+    '''Compiles the test type for a site config. Raises ValueError if the test type doesn't exist or the compare value doesn't suit it.'''
+    if test_type not in TEST_TYPES:
+        raise ValueError(f"Parameter 'testType' must be one of {', '.join(repr(name) for name in TEST_TYPES)}.")
+    return TEST_TYPES[test_type](compare_value)
+
+class TestType(ABC):
+    '''A kind of test that a site can run on its element. The compare value is compiled once, when the site config is loaded, so each check only runs the compiled matcher.'''
+
+    met_message = 'element met its test' # printed when the test is first met
+
+    @abstractmethod
+    def __init__(self, compare_value):
+        '''Compiles the compare value. Raises ValueError if it doesn't suit the test type.'''
+
+    @abstractmethod
+    def check(self, page: Page, xpath: str) -> TestResult:
+        '''Runs the test against the element. Raises NoSuchElementException if it can't be found.'''
+
+@register_test_type('element_does_not_contain_text')
+class ElementDoesNotContainText(TestType):
+    '''Met when the element's innerHTML contains none of the compare values, such as "Out of Stock" in several languages. The check runs
+    inside the browser when there is one. Otherwise a list of phrases is matched in one pass by a PhraseMatcher.'''
+
+    met_message = 'element no longer contains the compare value'
+
+    def __init__(self, compare_value: str | list[str]):
+        phrases = [compare_value] if type(compare_value) == str else compare_value
+        if type(phrases) != list or len(phrases) == 0 or any(type(phrase) != str or not phrase for phrase in phrases):
+            raise ValueError("Parameter 'compareValue' must be a string, or a list of strings, that isn't empty.")
+        self.phrases = phrases
+        self.phrase_matcher = PhraseMatcher(phrases) if len(phrases) > 1 else None
+
+    def check(self, page: Page, xpath: str) -> TestResult:
+        check = page.check_contains(xpath, self.phrases, self.phrase_matcher)
+        return TestResult(not check.matched, check.excerpt)
+
+class RegexTest(TestType):
+    '''Searches the element's innerHTML with the compare value as a regular expression, compiled when the config is loaded.'''
+
+    met_when_found: bool
+
+    def __init__(self, compare_value: str):
+        if type(compare_value) != str:
+            raise ValueError("Parameter 'compareValue' must be a regular expression string.")
+        try:
+            self.pattern = re.compile(compare_value)
+        except re.error as error:
+            raise ValueError(f"Parameter 'compareValue' is not a valid regular expression ({error}).")
+
+    def check(self, page: Page, xpath: str) -> TestResult:
+        element_html = page.element_html(xpath)
+        match = self.pattern.search(element_html)
+        return TestResult((match is not None) == self.met_when_found, html_excerpt(element_html, match.start() if match is not None else -1))
+
+@register_test_type('element_matches_regex')
+class ElementMatchesRegex(RegexTest):
+    '''Met when the regular expression matches somewhere in the element's innerHTML.'''
+    met_when_found = True
+    met_message = 'element now matches the compare value'
+
+@register_test_type('element_does_not_match_regex')
+class ElementDoesNotMatchRegex(RegexTest):
+    '''Met when the regular expression doesn't match anywhere in the element's innerHTML.'''
+    met_when_found = False
+    met_message = 'element no longer matches the compare value'
+
+@register_test_type('price_below')
+class PriceBelow(TestType):
+    '''Met when the first price in the element's text is below the compare value.'''
+
+    met_message = 'price has dropped below the compare value'
+
+    def __init__(self, compare_value: int | float):
+        if type(compare_value) not in (int, float):
+            raise ValueError("Parameter 'compareValue' must be a number.")
+        self.threshold = compare_value
+
+    def check(self, page: Page, xpath: str) -> TestResult:
+        text = element_text(page.element_html(xpath))
+        price = parse_price(text)
+        if price is None:
+            raise ValueError(f'No price was found in the element. Element text: {text[:EXCERPT_LENGTH]!r}')
+        return TestResult(price < self.threshold, text[:EXCERPT_LENGTH])